@@ -24,6 +24,9 @@ from typing import Type, Union
 
 from .template import Backend
 from .cliffords2017 import CliffordClifford2017Backend
+from .distinguishable import DistinguishableBackend
+from .gram import GramBackend
+from .mis import MISBackend
 from .naive import NaiveBackend
 from .slos import SLOSBackend
 from .stepper import StepperBackend
@@ -31,7 +34,8 @@ from .strawberryfields import SFBackend
 
 
 class BackendFactory:
-    _backends = (NaiveBackend, CliffordClifford2017Backend, SFBackend, SLOSBackend, StepperBackend)
+    _backends = (NaiveBackend, CliffordClifford2017Backend, DistinguishableBackend, GramBackend, MISBackend, SFBackend,
+                 SLOSBackend, StepperBackend)
 
     def get_backend(self,
                     name: Union[str, None] = None) \
@@ -22,53 +22,150 @@
 
 from .template import Backend
 
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
 import numpy as np
 import quandelibc as qc
 from perceval.utils import BasicState
+from perceval.utils.matrix import loss_dilation
 
 
 def _square(x):
     return abs(x**2).real
 
 def _get_scale(w):
-    return max([max(abs(x.real), abs(x.imag)) for x in w])
+    # largest real or imaginary part in absolute value
+    return np.abs(w.view(np.float64)).max()
+
+def _choice(w, rng):
+    # same draw as rng.choice(len(w), p=w/sum(w)) without the argument checks
+    cdf = np.cumsum(w)
+    cdf /= cdf[-1]
+    return int(cdf.searchsorted(rng.random(), side='right'))
+
+def _sample_worker(us, count, dtype, seed_sequence):
+    # worker process side - count samples drawn from the stream of the seed sequence
+    out = np.empty((count, us.shape[1]), dtype=dtype)
+    CliffordClifford2017Backend._sample_chunk(us, count, np.random.default_rng(seed_sequence), out)
+    return out
 
 class CliffordClifford2017Backend(Backend):
     name = "CliffordClifford2017"
     supports_symbolic = False
     supports_circuit_computing = False
 
+    def __init__(self, cu, use_symbolic=None, n=None, mask=None, n_workers=1):
+        r"""
+        :param n_workers: number of worker processes sharing the shots of `samples` and `samples_iterator`,
+            1 for sampling in the current process
+        """
+        super().__init__(cu, use_symbolic=use_symbolic, n=n, mask=mask)
+        self._n_workers = n_workers
+        self._executor = None
+        # (transfer matrix, its loss dilation) of the last sampling
+        self._dilation = None
+
+    def __del__(self):
+        if getattr(self, "_executor", None) is not None:
+            self._executor.shutdown(wait=False)
+
     def prob_be(self, input_state, output_state, n=None, output_idx=None):
         raise NotImplementedError
 
+    def _prepare_us(self, input_state) -> np.ndarray:
+        # Us is the n*m matrix where row i is the column of the unitary for the i-th input photon - with a lossy
+        # transfer matrix, the columns of its dilation, the extra modes being the loss channels
+        if self._dilation is None or self._dilation[0] is not self._U:
+            self._dilation = (self._U, loss_dilation(self._U))
+        photon_modes = np.repeat(np.arange(self._m), list(input_state))
+        return np.ascontiguousarray(self._dilation[1][:, photon_modes].T, dtype=np.complex128)
+
+    @staticmethod
+    def _sample_chunk(us, count, rng, out) -> None:
+        n, m = us.shape
+        # one buffer per sub-matrix size, reused across shots
+        sub_matrices = {mode_limit: np.empty((mode_limit, mode_limit-1), dtype=np.complex128)
+                        for mode_limit in range(2, n+1)}
+        out[:count] = 0
+        for shot in range(count):
+            fs = out[shot]
+            if n > 1:
+                A = us[rng.permutation(n), :]
+            else:
+                A = us
+            if n == 0:
+                continue
+            mode_seq = [_choice(_square(A[0, :]), rng)]
+            fs[mode_seq[0]] = 1
+            for mode_limit in range(2, n+1):
+                # permanents of sub-matrices using Laplace-type expansion (arXiv:1505.05486)
+                sub_matrix = sub_matrices[mode_limit]
+                np.take(A[0:mode_limit], mode_seq, axis=1, out=sub_matrix)
+                sub_perm = np.array(qc.sub_permanents_cx(sub_matrix))
+                sub_perm /= _get_scale(sub_perm)
+                # generate next mode from there
+                perm_vector = np.dot(sub_perm, A[0:mode_limit])
+                next_mode = _choice(_square(perm_vector), rng)
+                mode_seq.append(next_mode)
+                fs[next_mode] += 1
+
+    def _seeded_chunk(self, us, count, dtype, seed_sequence) -> np.ndarray:
+        # the shots are split over n_workers streams spawned from the seed sequence, and concatenated in stream order
+        streams = seed_sequence.spawn(self._n_workers)
+        counts = [len(shots) for shots in np.array_split(np.arange(count), self._n_workers)]
+        if self._n_workers == 1:
+            return _sample_worker(us, count, dtype, streams[0])
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._n_workers)
+        futures = [self._executor.submit(_sample_worker, us, worker_count, dtype, stream)
+                   for worker_count, stream in zip(counts, streams)]
+        return np.concatenate([future.result() for future in futures])
+
+    def samples_iterator(self, input_state, count: int, chunk_size: int = 10000,
+                         seed: Optional[int] = None) -> Iterator[np.ndarray]:
+        r"""Generate `count` samples by chunks
+
+        Without `seed` and with a single worker, the samples are drawn from the global `np.random` state. Otherwise
+        each worker draws from its own `np.random.Generator` stream derived from `seed` - the samples are identical
+        for the same seed and number of workers. When `seed` is None, it is drawn from the global `np.random` state.
+
+        :param input_state: the input state
+        :param count: total number of samples
+        :param chunk_size: maximal number of samples per chunk
+        :param seed: seed of the random streams
+        :return: iterator on arrays of shape `(chunk, m)`, each row is the occupation of a sample
+        """
+        us = self._prepare_us(input_state)
+        dtype = np.min_scalar_type(input_state.n)
+        seed_sequence = None
+        if seed is not None or self._n_workers > 1:
+            if seed is None:
+                seed = np.random.randint(2**31)
+            seed_sequence = np.random.SeedSequence(seed)
+        while count > 0:
+            chunk = min(chunk_size, count)
+            if seed_sequence is None:
+                out = np.empty((chunk, us.shape[1]), dtype=dtype)
+                self._sample_chunk(us, chunk, np.random, out)
+            else:
+                out = self._seeded_chunk(us, chunk, dtype, seed_sequence)
+            count -= chunk
+            # the photons in the loss channels are not detected
+            yield out if out.shape[1] == self._m else np.ascontiguousarray(out[:, :self._m])
+
+    def samples(self, input_state, count: int, seed: Optional[int] = None) -> np.ndarray:
+        r"""Generate `count` samples
+
+        :param input_state: the input state
+        :param count: number of samples
+        :param seed: seed of the random streams, see `samples_iterator`
+        :return: array of shape `(count, m)`, each row is the occupation of a sample
+        """
+        chunks = list(self.samples_iterator(input_state, count, chunk_size=max(count, 1), seed=seed))
+        if not chunks:
+            return np.empty((0, self._m), dtype=np.min_scalar_type(input_state.n))
+        return chunks[0]
+
     def sample(self, input_state):
-        # prepare Us that is a m*n matrix
-        m = self._m
-        n = input_state.n
-        fs = [0]*m
-        Us = np.zeros((n, m), dtype=np.complex128)
-        # build Us while transposing it
-        rowidx = 0
-        for ik in range(self._m):
-            for i in range(input_state[ik]):
-                Us[rowidx, :] = self._U[:, ik]
-                rowidx += 1
-        if n > 1:
-            A = Us[np.random.permutation(n), :]
-        else:
-            A = Us
-        w = _square(A[0, :])
-        mode_seq = [np.random.choice(np.arange(0, m), p=w/sum(w), size=1)[0]]
-        fs[mode_seq[0]] = 1
-        for mode_limit in range(2, n+1):
-            # permanents of sub-matrices using Laplace-type expansion (arXiv:1505.05486)
-            sub_perm = np.array(qc.sub_permanents_cx(np.copy(np.reshape(A[0:mode_limit, mode_seq],
-                                                                        (-1, mode_limit-1)))))
-            sub_perm /= _get_scale(sub_perm)
-            # generate next mode from there
-            perm_vector = np.dot(sub_perm.transpose(), A[0:mode_limit])
-            w = _square(perm_vector)
-            next_mode = np.random.choice(np.arange(0, m), p=w/sum(w), size=1)[0]
-            mode_seq.append(next_mode)
-            fs[next_mode] += 1
-        return BasicState(fs)
+        return BasicState(self.samples(input_state, 1)[0].tolist())
@@ -0,0 +1,124 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+
+from perceval.utils import BasicState, Matrix
+from .slos import SLOSBackend
+
+
+class DistinguishableBackend(SLOSBackend):
+    r"""Simulation of fully distinguishable photons - the annotations of the states are ignored
+
+    Each photon goes independently from input mode :math:`i` to output mode :math:`j` with probability
+    :math:`|U_{j,i}|^2`. The output distribution is the SLOS chain run on the matrix :math:`|U|^2`, whose
+    non-normalized coefficients are the probabilities :math:`\mathrm{Perm}(|U_{s,t}|^2)/\prod_j s_j!`, a single output
+    is the permanent of a non-negative matrix, and sampling is linear in the number of photons.
+    """
+    name = "Distinguishable"
+    supports_symbolic = False
+    supports_circuit_computing = False
+
+    def __init__(self, u, use_symbolic=None, n=None, mask=None, lossless=False):
+        super().__init__(u, use_symbolic=use_symbolic, n=n, mask=mask, lossless=lossless)
+        self._transition = None
+
+    def _transition_matrix(self) -> np.ndarray:
+        # |U|^2, recomputed when the unitary is replaced
+        if self._transition is None or self._transition[0] is not self._U:
+            self._transition = (self._U, np.abs(np.asarray(self._U, dtype=complex))**2)
+        return self._transition[1]
+
+    def _build_loss_backend(self):
+        # the losses of distinguishable photons are classical: a single extra mode collects the lost photons
+        transition = self._transition_matrix()
+        lost = np.clip(1 - transition.sum(axis=0), 0, None)
+        if np.allclose(lost, 0):
+            return None
+        # a matrix whose squared moduli are the transition probabilities, without loss - the last column is never used,
+        # and the matrix is not unitary: its backend has to be lossless
+        u = np.zeros((self._m + 1, self._m + 1))
+        u[:self._m, :self._m] = np.sqrt(transition)
+        u[self._m, :self._m] = np.sqrt(lost)
+        u[self._m, self._m] = 1
+        return DistinguishableBackend(Matrix(u), use_symbolic=False, lossless=True)
+
+    def compile(self, input_states) -> bool:
+        # only the state arrays and maps are needed, the computation is done on demand
+        if isinstance(input_states, BasicState):
+            input_states = [input_states]
+        compiled = len(self.fsms)
+        self._compilation(input_states)
+        return len(self.fsms) != compiled
+
+    def probampli_be(self, input_state, output_state, n=None, output_idx=None):
+        raise NotImplementedError("distinguishable photons have no probability amplitude")
+
+    def _amplitudes_define_prob(self) -> bool:
+        return False
+
+    def prob_be(self, input_state, output_state, n=None, output_idx=None):
+        return self._prob_distinguishable(input_state, output_state)
+
+    def prob(self, input_state, output_state, n=None, skip_compile=False):
+        assert not input_state.has_polarization, "%s backend does not support polarization" % self.name
+        if input_state.n == 0:
+            return output_state.n == 0
+        if output_state.n < input_state.n and self.lossy:
+            return self._lossy_prob(input_state, output_state)
+        return self.prob_be(BasicState(list(input_state)), BasicState(list(output_state)))
+
+    def all_prob(self, input_state):
+        assert not input_state.has_polarization, "%s backend does not support polarization" % self.name
+        input_state = BasicState(list(input_state))
+        if self.lossy:
+            return self._lossy_all_prob(input_state)
+        return self._chain_coefs(input_state, self._transition_matrix()[np.newaxis]).real[0]
+
+    def samples(self, input_state, count: int) -> np.ndarray:
+        r"""Generate `count` samples, each photon being drawn independently
+
+        :param input_state: the input state
+        :param count: number of samples
+        :return: array of shape `(count, m)`, each row is the occupation of a sample
+        """
+        if self._mask is not None:
+            # the mask conditions the whole output state, not the single photons
+            return super().samples(input_state, count)
+        m = self._m
+        cols = np.repeat(np.arange(m), list(input_state))
+        transition = self._transition_matrix()[:, cols]
+        # the lost photons go to an extra mode m, dropped from the samples
+        transition = np.vstack([transition, np.clip(1 - transition.sum(axis=0), 0, None)])
+        cumulative = np.cumsum(transition, axis=0)
+        uniforms = np.random.random((count, len(cols))) * cumulative[-1]
+        modes = np.empty((count, len(cols)), dtype=int)
+        for k in range(len(cols)):
+            modes[:, k] = np.minimum(cumulative[:, k].searchsorted(uniforms[:, k], side='right'), m)
+        occupations = np.bincount((np.arange(count)[:, np.newaxis] * (m + 1) + modes).reshape(-1),
+                                  minlength=count * (m + 1))
+        return occupations.reshape(count, m + 1)[:, :m].astype(np.min_scalar_type(input_state.n))
+
+    def sample(self, input_state):
+        if self._mask is not None:
+            return super().sample(input_state)
+        return BasicState(self.samples(input_state, 1)[0].tolist())
@@ -0,0 +1,142 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import itertools
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import quandelibc as qc
+from perceval.utils import BasicState
+
+from .template import Backend
+
+
+def _derangements(n: int) -> Iterator[Tuple[int, ...]]:
+    for permutation in itertools.permutations(range(n)):
+        if all(permutation[k] != k for k in range(n)):
+            yield permutation
+
+
+class GramBackend(Backend):
+    r"""Partial distinguishability from the Gram matrix of the photon internal states (arXiv:1410.1506)
+
+    With :math:`S_{k,l}` the overlap of the internal states of photons :math:`k` and :math:`l` and :math:`M` the
+    :math:`n \times n` matrix of the unitary with rows and columns repeated by output and input occupations
+    :math:`s` and :math:`t`:
+
+    .. math::
+        P(s) = \frac{1}{\prod_j s_j!\prod_j t_j!}\sum_{\sigma\in S_n}\prod_k S_{k,\sigma(k)}\,
+               \mathrm{Perm}(M \circ M^*_{:,\sigma})
+
+    The photons are numbered in the order of their input modes. The terms are grouped by order - the number of
+    photons moved by :math:`\sigma` - and the sum can be truncated at a maximal order: the order :math:`0` is the
+    distinguishable particle distribution, and higher orders add the interferences of more and more photons.
+    """
+    name = "Gram"
+    supports_symbolic = False
+    supports_circuit_computing = False
+
+    def __init__(self, cu, use_symbolic=None, n=None, mask=None, gram: Optional[np.ndarray] = None,
+                 max_order: Optional[int] = None):
+        r"""
+        :param gram: the :math:`n \times n` Gram matrix of the photon internal states, None for indistinguishable
+            photons
+        :param max_order: maximal number of photons moved by the permutations of the sum, None for the exact sum
+        """
+        super().__init__(cu, use_symbolic=use_symbolic, n=n, mask=mask)
+        self.gram = gram
+        self.max_order = max_order
+
+    @property
+    def gram(self) -> Optional[np.ndarray]:
+        return self._gram
+
+    @gram.setter
+    def gram(self, gram: Optional[np.ndarray]) -> None:
+        if gram is not None:
+            gram = np.asarray(gram, dtype=complex)
+            assert gram.ndim == 2 and gram.shape[0] == gram.shape[1], "the Gram matrix should be square"
+            assert np.allclose(np.diag(gram), 1), "the internal states should be normalized"
+        self._gram = gram
+        self._terms = None
+
+    @staticmethod
+    def overlap_gram(indistinguishable_fractions: Sequence[float]) -> np.ndarray:
+        r"""Gram matrix of photons having a common internal state with probability :math:`x_k`, and otherwise
+        an internal state of their own - as produced by `Source` with `indistinguishability_model="linear"` and
+        :math:`x_k` the indistinguishability
+
+        :param indistinguishable_fractions: :math:`x_k` for each photon
+        :return: the matrix :math:`S_{k,l}=\sqrt{x_kx_l}` with a unit diagonal
+        """
+        root = np.sqrt(np.asarray(indistinguishable_fractions, dtype=float))
+        gram = np.outer(root, root).astype(complex)
+        np.fill_diagonal(gram, 1)
+        return gram
+
+    def _permutations(self, n: int) -> List[Tuple[List[int], complex]]:
+        # permutations of the photons with their weight, kept for the next outputs
+        if self._terms is None or self._terms[0] != (n, self.max_order):
+            self._terms = ((n, self.max_order), list(self._generate_permutations(n)))
+        return self._terms[1]
+
+    def _generate_permutations(self, n: int) -> Iterator[Tuple[List[int], complex]]:
+        # permutations of the photons with their weight, by increasing order
+        gram = self._gram
+        if gram is None:
+            gram = np.ones((n, n), dtype=complex)
+        assert gram.shape == (n, n), "the Gram matrix should be %dx%d" % (n, n)
+        max_order = n if self.max_order is None else min(self.max_order, n)
+        for order in range(max_order + 1):
+            for moved in itertools.combinations(range(n), order):
+                for derangement in _derangements(order):
+                    permutation = list(range(n))
+                    weight = 1
+                    for k, d in zip(moved, derangement):
+                        permutation[k] = moved[d]
+                        weight *= gram[k, moved[d]]
+                    if weight != 0:
+                        yield permutation, weight
+
+    def prob_be(self, input_state, output_state, n=None, output_idx=None):
+        if input_state.n != output_state.n:
+            return 0
+        rows = np.repeat(np.arange(self._realm), list(output_state))
+        cols = np.repeat(np.arange(self._realm), list(input_state))
+        m = np.asarray(self._U, dtype=complex)[np.ix_(rows, cols)]
+        prob = 0
+        for permutation, weight in self._permutations(input_state.n):
+            prob += weight * qc.permanent_cx(np.ascontiguousarray(m * m[:, permutation].conj()))
+        return prob.real / (output_state.prodnfact() * input_state.prodnfact())
+
+    def probampli_be(self, input_state, output_state, n=None, output_idx=None):
+        raise NotImplementedError("partially distinguishable photons have no probability amplitude")
+
+    def _amplitudes_define_prob(self) -> bool:
+        return False
+
+    def prob(self, input_state, output_state, n=None, skip_compile=False):
+        assert not input_state.has_polarization, "%s backend does not support polarization" % self.name
+        if input_state.n == 0:
+            return output_state.n == 0
+        # the Gram matrix replaces the annotations
+        return self.prob_be(BasicState(list(input_state)), BasicState(list(output_state)))
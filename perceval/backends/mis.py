@@ -0,0 +1,149 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from typing import Dict, Optional
+
+import numpy as np
+import quandelibc as qc
+from perceval.utils import BasicState
+
+from .template import Backend
+
+
+class MISBackend(Backend):
+    r"""Approximate boson sampler by Metropolised Independence Sampling (arXiv:1705.00686)
+
+    The chain runs on the assignments of an output mode to each input photon. The proposal is the distinguishable
+    particle distribution - each photon independently goes to output mode :math:`j` with probability
+    :math:`|U_{j,i}|^2` - and the target probability of an assignment is proportional to
+    :math:`|\mathrm{Perm}(U_{out,in})|^2`, so that each step costs a single permanent.
+    """
+    name = "MIS"
+    supports_symbolic = False
+    supports_circuit_computing = False
+
+    def __init__(self, cu, use_symbolic=None, n=None, mask=None, burn_in: int = 100, thinning: int = 1,
+                 n_threads: int = 1):
+        r"""
+        :param burn_in: number of steps of the chain discarded at the beginning of each `samples` call
+        :param thinning: one state of the chain is kept every `thinning` steps
+        :param n_threads: number of threads used for the permanent computation
+        """
+        super().__init__(cu, use_symbolic=use_symbolic, n=n, mask=mask)
+        assert burn_in >= 0 and thinning >= 1, "invalid burn-in or thinning"
+        self._burn_in = burn_in
+        self._thinning = thinning
+        self._n_threads = n_threads
+        self._accepted = 0
+        self._steps = 0
+        self._trace = np.empty(0)
+
+    def prob_be(self, input_state, output_state, n=None, output_idx=None):
+        raise NotImplementedError
+
+    def _weight(self, assignment, cols, proposal_probs):
+        # target over proposal probability of an assignment of output modes to the input photons
+        perm = qc.permanent_cx(np.ascontiguousarray(self._U[np.ix_(assignment, cols)], dtype=complex),
+                               n_threads=self._n_threads)
+        q = np.prod(proposal_probs[assignment, np.arange(len(cols))])
+        if q == 0:
+            return 0, 0
+        return abs(perm)**2, abs(perm)**2 / q
+
+    def samples(self, input_state, count: int) -> np.ndarray:
+        r"""Generate `count` samples from a new chain, after the burn-in
+
+        :param input_state: the input state
+        :param count: number of samples
+        :return: array of shape `(count, m)`, each row is the occupation of a sample
+        """
+        m = self._m
+        n = input_state.n
+        out = np.zeros((count, m), dtype=np.min_scalar_type(n))
+        if n == 0 or count == 0:
+            return out
+        cols = np.repeat(np.arange(m), list(input_state))
+        proposal_probs = np.abs(np.asarray(self._U, dtype=complex)[:, cols])**2
+        cumulative = np.cumsum(proposal_probs, axis=0)
+        steps = self._burn_in + count * self._thinning
+        # all the proposals are drawn at once: photon k goes to mode searchsorted(cumulative[:, k], u)
+        uniforms = np.random.random((steps + 1, n)) * cumulative[-1]
+        proposals = np.empty((steps + 1, n), dtype=int)
+        for k in range(n):
+            proposals[:, k] = np.minimum(cumulative[:, k].searchsorted(uniforms[:, k], side='right'), m - 1)
+        acceptance = np.random.random(steps)
+        current = proposals[0]
+        current_prob, current_weight = self._weight(current, cols, proposal_probs)
+        accepted = 0
+        trace = np.empty(count)
+        for step in range(steps):
+            candidate = proposals[step + 1]
+            candidate_prob, candidate_weight = self._weight(candidate, cols, proposal_probs)
+            # a chain starting on a zero-probability assignment accepts the first valid candidate
+            if candidate_weight > 0 and (current_weight == 0 or
+                                         acceptance[step] * current_weight < candidate_weight):
+                current, current_prob, current_weight = candidate, candidate_prob, candidate_weight
+                accepted += 1
+            kept = step - self._burn_in
+            if kept >= 0 and (kept + 1) % self._thinning == 0:
+                sample_idx = kept // self._thinning
+                out[sample_idx] = np.bincount(current, minlength=m)
+                trace[sample_idx] = current_prob
+        self._accepted = accepted
+        self._steps = steps
+        self._trace = trace
+        return out
+
+    def sample(self, input_state):
+        return BasicState(self.samples(input_state, 1)[0].tolist())
+
+    @property
+    def acceptance_rate(self) -> float:
+        r"""Fraction of accepted proposals in the last `samples` call"""
+        if not self._steps:
+            return 0
+        return self._accepted / self._steps
+
+    def autocorrelation(self, max_lag: Optional[int] = None) -> np.ndarray:
+        r"""Normalized autocorrelation of the probabilities of the samples kept in the last `samples` call
+
+        :param max_lag: largest lag, by default half the number of samples
+        :return: the autocorrelation for the lags :math:`0..max\_lag`
+        """
+        trace = self._trace - self._trace.mean()
+        if max_lag is None:
+            max_lag = len(trace) // 2
+        variance = np.dot(trace, trace)
+        if variance == 0:
+            return np.ones(max_lag + 1)
+        return np.asarray([np.dot(trace[:len(trace)-lag], trace[lag:]) / variance for lag in range(max_lag + 1)])
+
+    def diagnostics(self, max_lag: Optional[int] = None) -> Dict[str, object]:
+        r"""Diagnostics of the last `samples` call
+
+        :param max_lag: largest lag of the autocorrelation
+        :return: the acceptance rate, the autocorrelation and the integrated autocorrelation time
+        """
+        autocorrelation = self.autocorrelation(max_lag)
+        return {"acceptance_rate": self.acceptance_rate,
+                "autocorrelation": autocorrelation,
+                "integrated_autocorrelation_time": 1 + 2 * float(np.sum(autocorrelation[1:]))}
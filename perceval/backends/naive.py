@@ -24,8 +24,27 @@ import math
 import numpy as np
 
 from .template import Backend
+from perceval.utils.permanent import glynn_terms, permanent_multiplicities
 import quandelibc as qc
 
+_factorials = [1]
+
+# costs of the repeated rows permanent in steps of the dense Glynn formula (n2^(n-1) steps), estimated by timing both
+_MULTIPLICITIES_FIXED_COST = 30000
+"numpy overhead of a call"
+_MULTIPLICITIES_TERM_COST = 200
+"cost of each term of the repeated rows formula"
+
+
+def _prodnfact(occupations) -> int:
+    r"""product of the factorials of the occupation numbers, read from a table extended on demand"""
+    p = 1
+    for count in occupations:
+        while count >= len(_factorials):
+            _factorials.append(_factorials[-1]*len(_factorials))
+        p *= _factorials[count]
+    return p
+
 
 class NaiveBackend(Backend):
     """Naive algorithm, no clever calculation path, does not cache anything,
@@ -34,26 +53,97 @@ class NaiveBackend(Backend):
     supports_symbolic = False
     supports_circuit_computing = False
 
+    def __init__(self, cu, use_symbolic=None, n=None, mask=None, n_threads=1):
+        r"""
+        :param n_threads: number of threads used for the permanent computation
+        """
+        super().__init__(cu, use_symbolic=use_symbolic, n=n, mask=mask)
+        self._n_threads = n_threads
+        # gather of the last input state (state, column indexes, factorials product) and one buffer per n
+        self._input_gather = None
+        self._ust_buffers = {}
+        self._u_flat = None
+
+    def _changed_unitary(self, prev_u) -> None:
+        self._u_flat = None
+
+    @staticmethod
+    def _use_multiplicities(input_state, output_state, n):
+        r"""True if the permanent is cheaper with the repeated rows formula than with the dense one - the dense
+        Glynn formula is :math:`n2^{n-1}`, the repeated rows one has a higher fixed cost (numpy) per call
+        """
+        if n * 2**(n-1) <= _MULTIPLICITIES_FIXED_COST:
+            return False
+        terms = min(glynn_terms(list(input_state)), glynn_terms(list(output_state)))
+        return _MULTIPLICITIES_FIXED_COST + _MULTIPLICITIES_TERM_COST * terms < n * 2**(n-1)
+
+    def _permanent_multiplicities(self, input_state, output_state):
+        input_modes = [k for k in range(self._realm) if input_state[k]]
+        output_modes = [k for k in range(self._realm) if output_state[k]]
+        return permanent_multiplicities(self._U[np.ix_(output_modes, input_modes)],
+                                        [output_state[k] for k in output_modes],
+                                        [input_state[k] for k in input_modes])
+
     def probampli_be(self, input_state, output_state, n=None, output_idx=None):
         if input_state.n != output_state.n:
             return 0
         if n is None:
             n = input_state.n
-        Ust = np.empty((n, n), dtype=complex)
-        colidx = 0
-        p = 1
-        for ok in range(self._realm):
-            p *= math.factorial(output_state[ok])
-        for ik in range(self._realm):
-            p *= math.factorial(input_state[ik])
-            for i in range(input_state[ik]):
-                rowidx = 0
-                for ok in range(self._realm):
-                    for j in range(output_state[ok]):
-                        Ust[rowidx, colidx] = self._U[ok, ik]
-                        rowidx += 1
-                colidx += 1
-        return qc.permanent_cx(Ust, n_threads=1)/math.sqrt(p)
+        output_occupations = list(output_state)
+        _, cols, input_prodnfact = self._gather_input(input_state)
+        p = _prodnfact(output_occupations) * input_prodnfact
+        if self._use_multiplicities(input_state, output_state, n):
+            return self._permanent_multiplicities(input_state, output_state)/math.sqrt(p)
+        if n not in self._ust_buffers:
+            self._ust_buffers[n] = np.empty((n, n), dtype=complex)
+        Ust = self._ust_buffers[n]
+        # Ust[i, j] = U[rows[i], cols[j]], gathered on the flattened unitary
+        rows = np.repeat(np.arange(self._realm), output_occupations)
+        if self._u_flat is None:
+            self._u_flat = np.ascontiguousarray(self._U, dtype=complex).ravel()
+        np.take(self._u_flat, rows[:, np.newaxis] * self._realm + cols, out=Ust)
+        return qc.permanent_cx(Ust, n_threads=self._n_threads)/math.sqrt(p)
 
     def prob_be(self, input_state, output_state, n=None, output_idx=None):
         return abs(self.probampli_be(input_state, output_state, n, output_idx))**2
+
+    @staticmethod
+    def _photon_modes(state):
+        return [k for k in range(state.m) for _ in range(state[k])]
+
+    def _gather_input(self, input_state):
+        r"""column indexes and factorials product of the input state, computed once for consecutive calls
+        """
+        if self._input_gather is None or self._input_gather[0] != input_state:
+            occupations = list(input_state)
+            self._input_gather = (input_state, np.repeat(np.arange(self._realm), occupations),
+                                  _prodnfact(occupations))
+        return self._input_gather
+
+    def _batch_outputs(self, output_states):
+        # for each photon count: output positions in the batch, mode of each output photon and normalization factor
+        plan = {}
+        for oidx, output_state in enumerate(output_states):
+            plan.setdefault(output_state.n, []).append(oidx)
+        for n, positions in plan.items():
+            rows = np.asarray([self._photon_modes(output_states[oidx]) for oidx in positions],
+                              dtype=int).reshape(len(positions), n)
+            norms = np.sqrt(np.asarray([_prodnfact(output_states[oidx]) for oidx in positions], dtype=float))
+            plan[n] = (np.asarray(positions), rows, norms)
+        return plan
+
+    def _probampli_batch_be(self, input_state, output_states, outputs_plan):
+        amplis = np.zeros(len(output_states), dtype=complex)
+        if input_state.n in outputs_plan:
+            positions, rows, norms = outputs_plan[input_state.n]
+            _, cols, input_prodnfact = self._gather_input(input_state)
+            # all the permanent sub-matrices in one gather: Ust[k, i, j] = U[rows[k, i], cols[j]]
+            all_ust = np.ascontiguousarray(self._U[rows[:, :, np.newaxis], cols[np.newaxis, np.newaxis, :]],
+                                           dtype=complex)
+            for oidx, ust in zip(positions, all_ust):
+                if self._use_multiplicities(input_state, output_states[oidx], input_state.n):
+                    amplis[oidx] = self._permanent_multiplicities(input_state, output_states[oidx])
+                else:
+                    amplis[oidx] = qc.permanent_cx(ust, n_threads=self._n_threads)
+            amplis[positions] /= norms * math.sqrt(input_prodnfact)
+        return amplis
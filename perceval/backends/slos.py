@@ -20,14 +20,53 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator, List, Optional
+
 import numpy as np
 import sympy as sp
 
 from .template import Backend
-from perceval.utils import Matrix, BasicState
+from perceval.utils import Matrix, BasicState, AnnotatedBasicState, StateVector, PostSelect
+from perceval.utils.matrix import loss_dilation, unitary_completion
 import quandelibc as qc
 
 
+def _row_keys(occupations: np.ndarray) -> np.ndarray:
+    r"""One sortable key per occupation vector (row)"""
+    occupations = np.ascontiguousarray(occupations)
+    return occupations.view(np.dtype((np.void, occupations.dtype.itemsize*occupations.shape[1]))).ravel()
+
+
+_worker_backends = {}
+"worker process side - SLOS backends compiled for the subtrees the worker has computed, reused across calls"
+
+
+def _compute_subtree(shm_name: str, offsets: List[int], u: np.ndarray, n: Optional[int], mask: Optional[list],
+                     states: List[List[int]], low_memory: bool) -> None:
+    r"""Worker process side - compute the coefficients of `states`, and write them in shared memory at `offsets`"""
+    key = (u.shape, n, mask and tuple(mask), tuple(tuple(state) for state in states))
+    backend = _worker_backends.get(key)
+    if backend is None:
+        if len(_worker_backends) >= 16:
+            _worker_backends.pop(next(iter(_worker_backends)))
+        backend = SLOSBackend(Matrix(u), use_symbolic=False, n=n, mask=mask, low_memory=low_memory)
+        backend.compile([BasicState(state) for state in states])
+        _worker_backends[key] = backend
+    else:
+        backend.rebind(u)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        for state, offset in zip(states, offsets):
+            coefs = backend.state_mapping[BasicState(state)].coefs
+            np.ndarray((coefs.shape[0],), dtype=complex, buffer=shm.buf, offset=offset)[:] = coefs[:, 0]
+    finally:
+        shm.close()
+
+
 class ComputePath:
     """A `ComputePath` is the minimal computing graph for covering a set of input states
     """
@@ -35,19 +74,23 @@ class ComputePath:
     def __init__(self, n, states, targets, backend):
         self._n = n
         self._backend = backend
-        self.coefs = Matrix.zeros((backend.mk_l[n], 1),
-                                  use_symbolic=self._backend.is_symbolic())
-        if n == 0:
-            self.coefs.fill(1)
+        self._covered_states = list(states)
+        self.coefs = None
+        if not backend.low_memory and backend._n_workers == 1:
+            # with workers, only the nodes of the input states get coefficients, allocated on demand
+            self._allocate()
 
         if targets is None:
             targets = [list(state) for state in states]
         self._targets = []
         self._states = []
         self._children = {}
+        self._is_target = False
         for t, s in zip(targets, states):
             if sum(t) == 0:
                 backend.state_mapping[s] = self
+                self._is_target = True
+                self.prodnfact = s.prodnfact()
             else:
                 self._targets.append(t)
                 self._states.append(s)
@@ -80,21 +123,38 @@ class ComputePath:
             targets = new_targets
             states = new_states
 
-    def compute(self, u, parent_coefs: Matrix = None, mk: int = None):
-        r"""Given the precompiled compute path, update all the coefficients"""
-        if parent_coefs is not None:
-            if self._backend._use_symbolic:
-                self.coefs.fill(0)
-                for parent_idx, coef_parent in enumerate(parent_coefs):
-                    for j in range(self._backend._realm):
-                        idx = self._backend.fsms[self._n].get(parent_idx, j)
-                        if idx != qc.npos:
-                            self.coefs[idx] += coef_parent * u[j, mk]
-            else:
-                self._backend.fsms[self._n].compute_slos_layer(u, self._backend._realm, mk, self.coefs, parent_coefs)
+    def _allocate(self):
+        self.coefs = Matrix.zeros((self._backend.mk_l[self._n], 1),
+                                  use_symbolic=self._backend.is_symbolic())
+        if self._n == 0:
+            self.coefs.fill(1)
 
+    def _compute_layer(self, u, parent_coefs: Matrix, mk: int):
+        r"""Compute the coefficients of the node from the coefficients of its parent"""
+        if self.coefs is None:
+            self._allocate()
+        if self._backend._use_symbolic:
+            self.coefs.fill(0)
+            for parent_idx, coef_parent in enumerate(parent_coefs):
+                for j in range(self._backend._realm):
+                    idx = self._backend.fsms[self._n].get(parent_idx, j)
+                    if idx != qc.npos:
+                        self.coefs[idx] += coef_parent * u[j, mk]
+        else:
+            self._backend.fsms[self._n].compute_slos_layer(u, self._backend._realm, mk, self.coefs, parent_coefs)
+
+    def compute(self, u):
+        r"""Given the precompiled compute path, update all the coefficients"""
+        if self.coefs is None:
+            # only the root can be computed without its parent
+            self._allocate()
         for mk, child in self._children.items():
-            child.compute(u, self.coefs, mk)
+            child._compute_layer(u, self.coefs, mk)
+        if self._backend.low_memory and not self._is_target:
+            # all the children are computed, the intermediate layer is not needed anymore
+            self.coefs = None
+        for child in self._children.values():
+            child.compute(u)
 
 
 class SLOSBackend(Backend):
@@ -103,20 +163,145 @@ class SLOSBackend(Backend):
     supports_symbolic = True
     supports_circuit_computing = False
 
-    def __init__(self, u, use_symbolic=None, n=None, mask=None):
+    def __init__(self, u, use_symbolic=None, n=None, mask=None, low_memory=False, n_workers=1, lossless=False):
+        r"""
+        :param low_memory: if True, the intermediate layers of the compute paths are freed as soon as they are not
+            needed anymore - only the coefficients of the input states are kept
+        :param n_workers: number of worker processes computing the independent subtrees of the compute paths,
+            1 for computing in the current process
+        :param lossless: if True, the matrix is simulated as is, without the outputs with lost photons even if it is
+            not unitary
+        """
         super().__init__(u, use_symbolic=use_symbolic, n=n, mask=mask)
-        self._compute_path = None
+        self.low_memory = low_memory
+        self._lossless = lossless
+        # the workers rebuild the mask from its conditions
+        if isinstance(mask, PostSelect):
+            mask = mask.mask(self._m, n)
+        self._mask_def = (n, mask)
+        self._n_workers = n_workers
+        self._executor = None
+        self._compute_paths = []
+        # (transfer matrix, backend simulating its loss dilation or None, loss-resolved distributions)
+        self._loss = None
         self._changed_unitary(None)
 
+    def _build_loss_backend(self) -> Optional[SLOSBackend]:
+        # SLOS on a unitary completion of the dilation, the extra modes being the loss channels
+        w = loss_dilation(self._U)
+        if w.shape[0] == self._realm:
+            return None
+        return SLOSBackend(Matrix(unitary_completion(w)), use_symbolic=False, lossless=True)
+
+    def _loss_backend(self) -> Optional[Backend]:
+        r"""Backend simulating the loss dilation of the transfer matrix, None if the transfer matrix is unitary"""
+        if self._lossless or self._use_symbolic or self._requires_polarization:
+            return None
+        if self._loss is None or self._loss[0] is not self._U:
+            backend = None
+            if np.linalg.svd(np.asarray(self._U, dtype=complex), compute_uv=False).max() < 1 + 1e-8:
+                backend = self._build_loss_backend()
+            if backend is not None:
+                assert self._mask is None, "masks are not supported with a lossy transfer matrix"
+            self._loss = (self._U, backend, {})
+        return self._loss[1]
+
+    @property
+    def lossy(self) -> bool:
+        r"""True if the transfer matrix is not unitary - the outputs then include the states with lost photons"""
+        return self._loss_backend() is not None
+
+    def _lossy_all_prob(self, input_state) -> np.ndarray:
+        r"""Loss-resolved distribution: the dilation distribution summed over the loss channels, on the outputs
+        with :math:`n, n-1, ..., 0` photons in the order of `allstate_iterator`
+        """
+        backend = self._loss_backend()
+        input_state = BasicState(list(input_state))
+        distributions = self._loss[2]
+        if input_state not in distributions:
+            n = input_state.n
+            prob = backend.all_prob(BasicState(list(input_state) + [0] * (backend.m - self._m)))
+            detected = backend._fsa_occupations(n)[:, :self._m]
+            keys = _row_keys(self._lossy_occupations(n))
+            order = np.argsort(keys)
+            idx = order[np.searchsorted(keys, _row_keys(detected), sorter=order)]
+            distributions[input_state] = np.bincount(idx, weights=prob, minlength=len(keys))
+        return distributions[input_state]
+
+    def _lossy_occupations(self, n) -> np.ndarray:
+        r"""Occupation vectors of the outputs with :math:`n, n-1, ..., 0` photons, in the order of
+        `allstate_iterator`
+        """
+        if ("lossy", n) not in self._occupations:
+            self._occupations[("lossy", n)] = np.concatenate([self._fsa_occupations(k) for k in range(n, -1, -1)])
+        return self._occupations[("lossy", n)]
+
+    def _lossy_prob(self, input_state, output_state) -> float:
+        n = input_state.n
+        offset = sum(self._fsa_occupations(k).shape[0] for k in range(output_state.n + 1, n + 1))
+        output_idx = qc.FSArray(self._m, output_state.n).find(output_state)
+        return self._lossy_all_prob(input_state)[offset + output_idx]
+
+    def _amplitudes_define_prob(self) -> bool:
+        # the states with lost photons have no amplitude
+        return not self.lossy
+
+    def prob(self, input_state, output_state, n=None, skip_compile=False):
+        if output_state.n < input_state.n and self.lossy:
+            assert not (isinstance(input_state, AnnotatedBasicState) and input_state.has_annotations), \
+                "lossy simulation does not support annotated states"
+            return self._lossy_prob(input_state, output_state)
+        return super().prob(input_state, output_state, n=n, skip_compile=skip_compile)
+
+    def allstate_iterator(self, input_state):
+        if not self.lossy:
+            yield from super().allstate_iterator(input_state)
+            return
+        ns = input_state.n
+        if not isinstance(ns, list):
+            ns = [ns]
+        for n in range(max(ns), -1, -1):
+            for output_state in qc.FSArray(self._m, n):
+                yield AnnotatedBasicState(output_state)
+
+    @staticmethod
+    def estimate_memory(m: int, n: int, mask: list = None, low_memory: bool = False) -> int:
+        r"""Estimate the memory needed by SLOS for simulating one input state with `n` photons in `m` modes
+
+        :param m: number of modes
+        :param n: number of photons
+        :param mask: a mask for output states, as for the backend constructor
+        :param low_memory: estimate for the `low_memory` mode
+        :return: estimated peak memory in bytes - state arrays, maps and coefficients
+        """
+        fsmask = mask is not None and qc.FSMask(m, n, mask) or None
+        counts = [(fsmask and qc.FSArray(m, k, fsmask) or qc.FSArray(m, k)).count() for k in range(n+1)]
+        coef_size = np.dtype(complex).itemsize
+        memory = 0
+        for k in range(1, n+1):
+            # a state is stored as the list of its photon modes, a map as one index per parent state and mode
+            index_size = 1
+            while 256**index_size <= counts[k]:
+                index_size *= 2
+            memory += counts[k] * k + counts[k-1] * m * index_size
+        if low_memory:
+            # at most a parent layer and its child layer are alive at the same time
+            memory += max(counts[k-1] + counts[k] for k in range(1, n+1)) * coef_size if n else coef_size
+        else:
+            memory += sum(counts) * coef_size
+        return memory
+
     def _changed_unitary(self, prev_u):
-        if self._compute_path is not None and prev_u is not None and prev_u.shape == self._U.shape:
+        if self._compute_paths and prev_u is not None and prev_u.shape == self._U.shape:
             self._calculation()
         else:
             self.mk_l = [1]
             self.fsms = [[]]
             self.fsas = {}
-            self._compute_path = None
+            self._compute_paths = []
             self.state_mapping = {}
+            self._occupations = {}
+            self._norms = {}
 
     def _compilation(self, input_states):
         # allocate the fsas and fsms for covering all the input_states respecting possible mask
@@ -150,47 +335,308 @@ class SLOSBackend(Backend):
         Simulation step: update computation path coef with unitary U
         :return:
         """
-        self._compute_path.compute(self._U)
+        if self._n_workers > 1 and not self._use_symbolic:
+            self._parallel_calculation(self._compute_paths)
+            return
+        for compute_path in self._compute_paths:
+            compute_path.compute(self._U)
+
+    def _parallel_calculation(self, compute_paths):
+        r"""Compute the children subtrees of the compute paths roots in worker processes - the coefficients of
+        the input states are sent back through a shared memory buffer
+        """
+        subtrees = []
+        for compute_path in compute_paths:
+            if compute_path._is_target:
+                # vacuum input state
+                compute_path._allocate()
+            subtrees += [child._covered_states for child in compute_path._children.values()]
+        coef_size = np.dtype(complex).itemsize
+        offsets = []
+        size = 0
+        for states in subtrees:
+            offsets.append([])
+            for state in states:
+                offsets[-1].append(size)
+                size += self.mk_l[state.n] * coef_size
+        if not size:
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._n_workers)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            u = np.asarray(self._U, dtype=complex)
+            n, mask = self._mask_def
+            futures = [self._executor.submit(_compute_subtree, shm.name, state_offsets, u, n, mask,
+                                             [list(state) for state in states], self.low_memory)
+                       for states, state_offsets in zip(subtrees, offsets)]
+            for future in futures:
+                future.result()
+            for states, state_offsets in zip(subtrees, offsets):
+                for state, offset in zip(states, state_offsets):
+                    node = self.state_mapping[state]
+                    if node.coefs is None:
+                        node._allocate()
+                    node.coefs[:, 0] = np.ndarray((self.mk_l[state.n],), dtype=complex, buffer=shm.buf,
+                                                  offset=offset)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def __del__(self):
+        if getattr(self, "_executor", None) is not None:
+            self._executor.shutdown(wait=False)
+
+    def rebind(self, u: Matrix) -> None:
+        r"""Change the unitary of the backend keeping everything compiled so far: the state arrays, the maps and the
+        compute paths are reused, and only the SLOS layers are recomputed with the new unitary
+
+        :param u: the new unitary, of same size as the current one
+        """
+        assert u.shape == self._U.shape, "rebind requires a unitary of same size"
+        if not self._use_symbolic:
+            u = Matrix(u, use_symbolic=False)
+        self._U = u
+        self._calculation()
+
+    def rebind_iterator(self, unitaries: Iterable[Matrix]) -> Iterator[SLOSBackend]:
+        r"""Rebind successively the backend to each of the unitaries
+
+        :param unitaries: the unitaries, all of the same size as the current one
+        :return: an iterator on the backend, rebound to each unitary in turn
+        """
+        for u in unitaries:
+            self.rebind(u)
+            yield self
 
     def compile(self, input_states):
-        if isinstance(input_states, BasicState):
+        if isinstance(input_states, qc.FockState):
             input_states = [input_states]
+        # separated states of a BasicState are plain fock states
+        input_states = [input_state if isinstance(input_state, BasicState) else BasicState(input_state)
+                        for input_state in input_states]
         # build the necessary fsa/fsms
         self._compilation(input_states)
         # now check if we have a path for the input states
-        found_new = False
+        new_states = []
         for input_state in input_states:
-            if found_new:
-                break
-            found_new = input_state not in self.state_mapping
-        if not found_new:
+            if input_state not in self.state_mapping and input_state not in new_states:
+                new_states.append(input_state)
+        if not new_states:
             return False
-        self._compute_path = ComputePath(0, input_states, None, self)
-        self._calculation()
+        compute_path = ComputePath(0, new_states, None, self)
+        self._compute_paths.append(compute_path)
+        if self._n_workers > 1 and not self._use_symbolic:
+            self._parallel_calculation([compute_path])
+        else:
+            compute_path.compute(self._U)
         return True
 
+    def _fsa_norms(self, n):
+        r"""Normalization factors :math:`\sqrt{\prod_k n_k!}` of the states with `n` photons, indexed as the FSArray"""
+        if n not in self._norms:
+            norms = np.ones(self.fsas[n].count(), dtype=complex)
+            self.fsas[n].norm_coefs(norms)
+            self._norms[n] = norms.real
+        return self._norms[n]
+
+    def indices_of(self, states) -> np.ndarray:
+        r"""Indexes of states in the state arrays of the backend - the arrays for the photon counts of the
+        states must already be compiled
+
+        :param states: a list of states
+        :return: integer array of the indexes, -1 for states not in the arrays (masked states)
+        """
+        indexes = np.full(len(states), -1, dtype=np.int64)
+        for k, state in enumerate(states):
+            if state.n in self.fsas:
+                idx = self.fsas[state.n].find(state)
+                if idx != qc.npos:
+                    indexes[k] = idx
+        return indexes
+
     def probampli_be(self, input_state, output_state, n=None, output_idx=None, norm=True):
         if input_state.n != output_state.n:
             return 0
         if output_idx is None:
             output_idx = self.fsas[output_state.n].find(output_state)
             assert output_idx != qc.npos
+        node = self.state_mapping[input_state]
         if not norm:
-            return self.state_mapping[input_state].coefs[output_idx, 0]
+            return node.coefs[output_idx, 0]
         if self._use_symbolic:
-            return self.state_mapping[input_state].coefs[output_idx, 0]\
-                   * sp.sqrt(output_state.prodnfact()/input_state.prodnfact())
+            return node.coefs[output_idx, 0] * sp.sqrt(output_state.prodnfact()/node.prodnfact)
         else:
-            return self.state_mapping[input_state].coefs[output_idx, 0]\
-                   * np.sqrt(output_state.prodnfact()/input_state.prodnfact())
+            return node.coefs[output_idx, 0] * self._fsa_norms(output_state.n)[output_idx] / np.sqrt(node.prodnfact)
 
     def prob_be(self, input_state, output_state, n=None, output_idx=None):
-        return abs(self.probampli_be(input_state, output_state, n, output_idx, False))**2\
-               * output_state.prodnfact()/input_state.prodnfact()
+        if input_state.n != output_state.n:
+            if output_state.n < input_state.n and self.lossy:
+                return self._lossy_prob(input_state, output_state)
+            return 0
+        if output_idx is None:
+            output_idx = self.fsas[output_state.n].find(output_state)
+            assert output_idx != qc.npos
+        node = self.state_mapping[input_state]
+        if self._use_symbolic:
+            return abs(node.coefs[output_idx, 0])**2 * output_state.prodnfact()/node.prodnfact
+        return abs(node.coefs[output_idx, 0])**2 * self._fsa_norms(output_state.n)[output_idx]**2/node.prodnfact
+
+    def probampli_batch(self, input_states, output_states):
+        input_states = list(input_states)
+        # a single compute path covering all the batch input states
+        batch_states = [input_state for input_state in input_states
+                        if input_state.n and self._batch_compatible(input_state)]
+        if batch_states:
+            self.compile(batch_states)
+        return super().probampli_batch(input_states, output_states)
+
+    def _batch_outputs(self, output_states):
+        # for each photon count of the compiled inputs: output positions in the batch, index in fsa and
+        # normalization factor
+        plan = {}
+        for oidx, output_state in enumerate(output_states):
+            if output_state.n in self.fsas:
+                plan.setdefault(output_state.n, []).append(oidx)
+        for n, positions in plan.items():
+            indexes = self.indices_of([output_states[oidx] for oidx in positions])
+            assert not np.any(indexes == -1), "output state not covered by the mask"
+            norms = self._fsa_norms(n)[indexes]
+            plan[n] = (np.asarray(positions), indexes, norms)
+        return plan
+
+    def _probampli_batch_be(self, input_state, output_states, outputs_plan):
+        amplis = np.zeros(len(output_states), dtype=complex)
+        if input_state.n in outputs_plan:
+            positions, indexes, norms = outputs_plan[input_state.n]
+            coefs = np.asarray(self.state_mapping[input_state].coefs).reshape(-1)
+            amplis[positions] = coefs[indexes] * norms / np.sqrt(self.state_mapping[input_state].prodnfact)
+        return amplis
+
+    def _chain_coefs(self, input_state: BasicState, unitaries: np.ndarray) -> np.ndarray:
+        r"""Non-normalized SLOS coefficients of an input state for each of a stack of matrices - only the state arrays
+        and maps are compiled, and the chain of layers leading to the input state is computed in preallocated buffers
+
+        :return: array of shape `(K, N)`
+        """
+        unitaries = np.asarray(unitaries, dtype=complex)
+        assert unitaries.ndim == 3 and unitaries.shape[1:] == (self._realm, self._realm), \
+            "unitaries should be a stack of %dx%d matrices" % (self._realm, self._realm)
+        self._compilation([input_state])
+        photon_modes = [mk for mk in range(input_state.m) for _ in range(input_state[mk])]
+        # one buffer per layer of the chain leading to the input state, reused for all the unitaries
+        layers = [np.ones((1, 1), dtype=complex)] + [np.zeros((self.mk_l[n], 1), dtype=complex)
+                                                     for n in range(1, input_state.n+1)]
+        coefs = np.empty((unitaries.shape[0], self.mk_l[input_state.n]), dtype=complex)
+        for k, u in enumerate(unitaries):
+            u = np.ascontiguousarray(u)
+            for n, mk in enumerate(photon_modes, 1):
+                self.fsms[n].compute_slos_layer(u, self._realm, mk, layers[n], layers[n-1])
+            coefs[k] = layers[-1][:, 0]
+        return coefs
+
+    def all_prob_stack(self, input_state: BasicState, unitaries: np.ndarray) -> np.ndarray:
+        r"""Output distributions of an input state through a stack of unitaries
+
+        The state arrays and maps of the backend are shared by all the unitaries, and only the chain of layers leading
+        to the input state is computed, in preallocated buffers.
+
+        :param input_state: the input state
+        :param unitaries: array of shape `(K, m, m)`
+        :return: array of shape `(K, N)` where `N` is the number of output states, in the order of `all_prob`
+        """
+        assert not self._use_symbolic, "all_prob_stack requires numeric computation"
+        coefs = self._chain_coefs(input_state, unitaries)
+        norm = np.ones(coefs.shape[1], dtype=complex)
+        self.fsas[input_state.n].norm_coefs(norm)
+        return abs(coefs * norm / np.sqrt(input_state.prodnfact()))**2
+
+    def _fsa_occupations(self, n):
+        r"""Occupation vectors of the states of the (masked) FSArray with `n` photons, one state per row"""
+        if n not in self._occupations:
+            fsa = self.fsas.get(n)
+            if fsa is None:
+                fsa = self._mask and qc.FSArray(self._realm, n, self._mask) or qc.FSArray(self._realm, n)
+            self._occupations[n] = np.asarray([list(state) for state in fsa], dtype=np.uint8)\
+                .reshape(fsa.count(), self._realm)
+        return self._occupations[n]
+
+    def _convolve_prob(self, occupations_a, prob_a, occupations_b, prob_b, n):
+        r"""Output distribution of two groups of distinguishable photons, given the distribution of each group
+
+        :return: probabilities over the FSArray with `n` photons
+        """
+        occupations = self._fsa_occupations(n)
+        if not len(occupations):
+            return np.zeros(0)
+        keys = _row_keys(occupations)
+        order = np.argsort(keys)
+        # every pair of outputs of the two groups, and its probability
+        combined_keys = _row_keys((occupations_a[:, np.newaxis, :] + occupations_b[np.newaxis, :, :])
+                                  .reshape(-1, self._realm))
+        combined_prob = (prob_a[:, np.newaxis] * prob_b[np.newaxis, :]).reshape(-1)
+        idx = order[np.minimum(np.searchsorted(keys, combined_keys, sorter=order), len(keys)-1)]
+        # combined states might be out of the mask
+        found = keys[idx] == combined_keys
+        return np.bincount(idx[found], weights=combined_prob[found], minlength=len(keys))
+
+    def _all_prob_distinguishable(self, input_states):
+        r"""Output distribution for groups of distinguishable photons - each group is simulated independently
+        and the distributions are convolved
+        """
+        self.compile(input_states)
+        n = 0
+        occupations = probs = None
+        for input_state in input_states:
+            group_prob = self.all_prob(input_state)
+            if probs is None:
+                probs = group_prob
+            else:
+                probs = self._convolve_prob(occupations, probs, self._fsa_occupations(input_state.n), group_prob,
+                                            n + input_state.n)
+            n += input_state.n
+            occupations = self._fsa_occupations(n)
+        return probs
 
     def all_prob(self, input_state):
+        if self.lossy:
+            assert not (isinstance(input_state, AnnotatedBasicState) and input_state.has_annotations), \
+                "lossy simulation does not support annotated states"
+            return self._lossy_all_prob(input_state)
+        if isinstance(input_state, AnnotatedBasicState) and input_state.has_annotations:
+            assert not input_state.has_polarization, "all_prob does not support polarized states"
+            input_states = [BasicState(list(state)) for state in input_state.separate_state()]
+            if len(input_states) == input_state.n > 1 and not self._use_symbolic:
+                # fully distinguishable photons: the SLOS chain on |U|^2 gives the probabilities
+                transition = np.abs(np.asarray(self._U, dtype=complex))**2
+                return self._chain_coefs(BasicState(list(input_state)), transition[np.newaxis]).real[0]
+            if len(input_states) > 1:
+                return self._all_prob_distinguishable(input_states)
+            input_state = input_states[0]
         self.compile(input_state)
         c = np.copy(self.state_mapping[input_state].coefs).reshape(self.fsas[input_state.n].count())
         self.fsas[input_state.n].norm_coefs(c)
-        c /= input_state.prodnfact()
+        c /= np.sqrt(input_state.prodnfact())
         return abs(c)**2
+
+    def allstateprob_iterator(self, input_state):
+        if isinstance(input_state, StateVector) and len(input_state) == 1:
+            input_state = input_state[0]
+        if self._use_symbolic or self._requires_polarization or isinstance(input_state, StateVector) \
+                or input_state.has_polarization:
+            yield from super().allstateprob_iterator(input_state)
+            return
+        # full distribution in one pass, in the order of `allstate_iterator`
+        yield from zip(self.allstate_iterator(input_state), self.all_prob(input_state))
+
+    def allstateprob_array(self, input_state):
+        if isinstance(input_state, StateVector) and len(input_state) == 1:
+            input_state = input_state[0]
+        if self._use_symbolic or self._requires_polarization or isinstance(input_state, StateVector) \
+                or input_state.has_polarization:
+            return super().allstateprob_array(input_state)
+        # the occupation arrays are cached, the same array is returned for the same number of photons
+        probs = self.all_prob(input_state)
+        if self.lossy:
+            return self._lossy_occupations(input_state.n), probs
+        return self._fsa_occupations(input_state.n), probs
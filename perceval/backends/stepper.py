@@ -20,21 +20,24 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from typing import List, Union
+from collections import OrderedDict
+from typing import List, Tuple, Union
 import copy
 
 from .template import Backend
-from perceval.utils import StateVector, BasicState, Matrix
+from perceval.utils import StateVector, BasicState, AnnotatedBasicState, Matrix, SVTimeSequence
 from perceval.components import ACircuit
 from .naive import NaiveBackend
 
+import numpy as np
 import quandelibc as qc
 
 
 class StepperBackend(Backend):
     """Step-by-step circuit propagation algorithm, main usage is on a circuit, but could work in degraded mode
        on a circuit defined with a unitary matrix.
-       - Use Naive backend for actual calculation of each component for non-symbolic resolution.
+       - Use Naive backend on the numeric unitary of each component for the transition amplitudes, the state is
+         propagated as dense arrays
        - TODO: Use SLOS backend for symbolic computation
     """
 
@@ -42,9 +45,29 @@ class StepperBackend(Backend):
                  cu: Union[ACircuit, Matrix],
                  use_symbolic: bool = None,
                  n: int = None,
-                 mask: list = None):
+                 mask: list = None,
+                 cache_size: int = 4096,
+                 time_window: int = None):
+        r"""
+        :param cache_size: maximal number of transition tables (component, parameter values, sub-input state) kept
+            across compiles, the least recently used tables are evicted first
+        :param time_window: for a circuit with time delays, number of periods emitting the input state - by default
+            one more than the total delay, so that the outputs of the last period have their full history
+        """
         self._out = None
-        super().__init__(cu, use_symbolic, n, mask)
+        # distribution of the outputs of the last period, for a circuit with time delays
+        self._time_out = None
+        self._cache_size = cache_size
+        # (component identity, parameter values, sub-input state) -> (component, amplitudes on the output states)
+        self._tables = OrderedDict()
+        self._fsa_occupations = {}
+        # component identity -> (component, parameter values, backend on the component unitary)
+        self._component_backends = {}
+        super().__init__(cu, use_symbolic=use_symbolic, n=n, mask=mask)
+        delays = [float(c._dt) for _, c in self._C if c.delay_circuit]
+        self._time_window = None
+        if delays:
+            self._time_window = time_window or 1 + int(sum(delays))
 
     name = "Stepper"
     supports_symbolic = False
@@ -58,49 +81,176 @@ class StepperBackend(Backend):
         :param c: a circuit
         :return: evolved StateVector
         """
+        if any(state.has_annotations for state in sv.iterate(normalize=False)):
+            return self._apply_annotated(sv, r, c)
+        return self._to_state_vector(*self._apply_arrays(*self._to_arrays(sv), list(r), c))
+
+    def _apply_annotated(self, sv: StateVector, r: List[int], c: ACircuit) -> StateVector:
         min_r = r[0]
-        max_r = r[-1]
-        # build list of fockstates corresponding to subspace [min_r:max_r]
-        sub_input_state = set()
-        for state in sv:
-            sub_input_state.add(BasicState(state[min_r:max_r]))
-        # get circuit probability for these input_states
-        sim_c = NaiveBackend(c.U, use_symbolic=self._use_symbolic)
-        mapping_input_output = {}
-        for input_state in sub_input_state:
-            mapping_input_output[input_state] = {}
-            for output_state in sim_c.allstate_iterator(input_state):
-                mapping_input_output[input_state][output_state] = sim_c.probampli(input_state, output_state)
-        # now rebuild the new state vector
+        max_r = r[-1]+1
+        params = self._parameter_values(c)
+        sv.normalize()
         nsv = StateVector()
-        for state in sv:
-            input_state = state[min_r:max_r]
-            for output_state, prob_ampli in mapping_input_output[input_state].items():
-                nsv[BasicState(state.set_slice(slice(min_r, max_r), output_state))] += prob_ampli*sv[state]
+        for state, amplitude in sv.items():
+            input_state = BasicState(state[min_r:max_r])
+            column = self._transition_column(c, params, input_state)
+            for output_state, prob_ampli in zip(qc.FSArray(max_r-min_r, input_state.n), column):
+                nsv[BasicState(state.set_slice(slice(min_r, max_r), output_state))] += prob_ampli*amplitude
         return nsv
 
+    @staticmethod
+    def _parameter_values(c: ACircuit) -> Tuple[float, ...]:
+        return tuple(float(p) for p in c.get_parameters(all_params=True))
+
+    def _to_arrays(self, sv: StateVector) -> Tuple[np.ndarray, np.ndarray]:
+        sv.normalize()
+        states = sv.keys()
+        occupations = np.asarray([list(state) for state in states], dtype=int).reshape(len(states), self._realm)
+        return occupations, np.array(sv.amplitudes, dtype=complex)
+
+    @staticmethod
+    def _to_state_vector(occupations: np.ndarray, amplitudes: np.ndarray) -> StateVector:
+        sv = StateVector()
+        for occupation, amplitude in zip(occupations.tolist(), amplitudes.tolist()):
+            sv[BasicState(occupation)] = amplitude
+        return sv
+
+    def _apply_arrays(self, occupations: np.ndarray, amplitudes: np.ndarray, r: List[int], c: ACircuit) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        r"""Apply a component on the columns `r` of a state given as occupation vectors (one per row) and amplitudes
+
+        For each number of photons in the subspace of the component, the amplitudes are arranged as a dense matrix
+        (rest of the state, sub-input state) and multiplied by the transition columns of the sub-input states.
+        """
+        params = self._parameter_values(c)
+        sub = occupations[:, r]
+        sub_n = sub.sum(axis=1)
+        new_occupations = []
+        new_amplitudes = []
+        for n in np.unique(sub_n):
+            rows = np.flatnonzero(sub_n == n)
+            if n == 0:
+                # the vacuum is invariant
+                new_occupations.append(occupations[rows])
+                new_amplitudes.append(amplitudes[rows])
+                continue
+            sub_inputs, sub_idx = np.unique(sub[rows], axis=0, return_inverse=True)
+            rest = occupations[rows]
+            rest[:, r] = 0
+            rests, rest_idx = np.unique(rest, axis=0, return_inverse=True)
+            dense = np.zeros((len(rests), len(sub_inputs)), dtype=complex)
+            dense[rest_idx.reshape(-1), sub_idx.reshape(-1)] = amplitudes[rows]
+            transition = np.stack([self._transition_column(c, params, BasicState(sub_input))
+                                   for sub_input in sub_inputs.tolist()], axis=1)
+            evolved = dense @ transition.T
+            # every rest of the state with every output state of the subspace
+            sub_outputs = self._sub_occupations(len(r), int(n))
+            outputs = np.repeat(rests[:, np.newaxis, :], len(sub_outputs), axis=1)
+            outputs[:, :, r] = sub_outputs[np.newaxis]
+            nonzero = evolved.reshape(-1) != 0
+            new_occupations.append(outputs.reshape(-1, occupations.shape[1])[nonzero])
+            new_amplitudes.append(evolved.reshape(-1)[nonzero])
+        if not new_occupations:
+            return occupations, amplitudes
+        return np.concatenate(new_occupations), np.concatenate(new_amplitudes)
+
+    def _sub_occupations(self, m: int, n: int) -> np.ndarray:
+        r"""Occupation vectors of the states of `FSArray(m, n)`, one state per row"""
+        if (m, n) not in self._fsa_occupations:
+            fsa = qc.FSArray(m, n)
+            self._fsa_occupations[(m, n)] = np.asarray([list(state) for state in fsa], dtype=int)\
+                .reshape(fsa.count(), m)
+        return self._fsa_occupations[(m, n)]
+
+    def _transition_column(self, c: ACircuit, params: Tuple[float, ...], input_state: BasicState) -> np.ndarray:
+        r"""Amplitudes of a component from a sub-input state to the states of `FSArray(m, n)`, kept in a LRU cache"""
+        key = (id(c), params, input_state)
+        cached = self._tables.get(key)
+        if cached is not None and cached[0] is c:
+            self._tables.move_to_end(key)
+            return cached[1]
+        component_backend = self._component_backends.get(id(c))
+        if component_backend is None or component_backend[0] is not c or component_backend[1] != params:
+            # numeric unitary, the symbolic one would go through a simplification for each component
+            component_backend = (c, params, NaiveBackend(c.compute_unitary(use_symbolic=False)))
+            if len(self._component_backends) >= self._cache_size:
+                self._component_backends.clear()
+            self._component_backends[id(c)] = component_backend
+        sim_c = component_backend[2]
+        column = np.asarray([sim_c.probampli(input_state, output_state)
+                             for output_state in qc.FSArray(c.m, input_state.n)], dtype=complex)
+        self._tables[key] = (c, column)
+        if len(self._tables) > self._cache_size:
+            self._tables.popitem(last=False)
+        return column
+
     def compile(self, input_states: Union[BasicState, StateVector]) -> bool:
         if isinstance(input_states, BasicState):
             sv = StateVector(input_states)
+        elif isinstance(input_states, qc.FockState):
+            # separated states of a BasicState are plain fock states
+            sv = StateVector(BasicState(input_states))
         else:
             sv = input_states
         var = [float(p) for p in self._C.get_parameters()]
         if self._compiled_input == (var, sv):
             return False
         self._compiled_input = copy.copy((var, sv))
-        for r, c in self._C:
-            if not c.delay_circuit:
-                # nsv = sv.align(r)
-                sv = self.apply(sv, r, c)
-            else:
-                sv.apply_delta_t(r[0], float(c._dt))
-        self._out = sv
+        if self._time_window is not None:
+            self._time_out = self._compile_time_sequence(sv).distribution()
+            return True
+        # the state goes through the components as arrays
+        if any(state.has_annotations for state in sv.iterate(normalize=False)):
+            for r, c in self._C:
+                sv = self._apply_annotated(sv, r, c)
+            self._out = sv
+        else:
+            arrays = self._to_arrays(sv)
+            for r, c in self._C:
+                arrays = self._apply_arrays(*arrays, list(r), c)
+            self._out = self._to_state_vector(*arrays)
         return True
 
+    def _compile_time_sequence(self, sv: StateVector) -> SVTimeSequence:
+        r"""Propagate the input state emitted at each period of the window: the components act on each period of the
+        window, the delays shift the photons to the next periods
+        """
+        sequence = SVTimeSequence(sv, self._time_window)
+        for r, c in self._C:
+            if c.delay_circuit:
+                sequence.apply_delta_t(r[0], float(c._dt))
+                continue
+            for period in range(self._time_window):
+                sequence.occupations, sequence.amplitudes = self._apply_arrays(sequence.occupations,
+                                                                               sequence.amplitudes,
+                                                                               sequence.modes(period, list(r)), c)
+        return sequence
+
+    def _amplitudes_define_prob(self) -> bool:
+        return self._time_window is None
+
+    def prob(self, input_state, output_state, n=None, skip_compile=False):
+        if self._time_window is None:
+            return super().prob(input_state, output_state, n=n, skip_compile=skip_compile)
+        # the outputs of a period are not a pure state, only their probabilities are defined
+        if not skip_compile:
+            self.compile(input_state)
+        return self._time_out.get(BasicState(list(output_state)), 0)
+
+    def allstate_iterator(self, input_state):
+        if self._time_window is None:
+            yield from super().allstate_iterator(input_state)
+            return
+        # the last period might receive the photons of all the periods
+        for n in range(input_state.n * self._time_window + 1):
+            for output_state in qc.FSArray(self._m, n):
+                yield AnnotatedBasicState(output_state)
+
     def prob_be(self, input_state, output_state, n=None, output_idx=None):
         return abs(self.probampli_be(input_state, output_state, n, output_idx))**2
 
     def probampli_be(self, _, output_state, n=None, output_idx=None):
+        assert self._time_window is None, "the outputs of a circuit with time delays have no amplitudes"
         if output_state not in self._out:
             return 0
         return self._out[output_state]
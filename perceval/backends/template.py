@@ -22,10 +22,9 @@
 
 from abc import ABC, abstractmethod
 import logging
-import random
 from typing import List, Tuple, Union, Iterator, Optional
 
-from perceval.utils import Matrix, StateVector, AnnotatedBasicState, BasicState
+from perceval.utils import Matrix, StateVector, AnnotatedBasicState, BasicState, PostSelect, DistributionSampler
 from perceval.utils.statevector import convert_polarized_state, build_spatial_output_states
 from ..components.circuit import ACircuit, _matrix_double_for_polarization
 
@@ -43,7 +42,7 @@ class Backend(ABC):
                  use_symbolic: bool = None,
                  use_polarization: Optional[bool] = None,
                  n: int = None,
-                 mask: list = None):
+                 mask: Union[list, PostSelect] = None):
         r"""
         :param cu: a circuit to simulate or a unitary Matrix symbolic or numeric
         :param use_symbolic: define if calculation should be symbolic or numeric:
@@ -51,7 +50,7 @@ class Backend(ABC):
             - True: calculation will be symbolic
             - False: calculation will be numeric
         :param n: expected number of input photons, necessary for applying masks
-        :param mask: a mask for output states that we are interested in
+        :param mask: a mask for output states that we are interested in, as a list of conditions or a `PostSelect`
         """
         self._logger = logging.getLogger(self._name)
         if not self.supports_circuit_computing:
@@ -103,11 +102,16 @@ class Backend(ABC):
 
         if mask is not None:
             assert n is not None, "number of photons required when using a mask"
+            if isinstance(mask, PostSelect):
+                mask = mask.mask(self._m, n)
+                assert mask is not None, "post-selection rejects all states with %d photons" % n
             self._mask = qc.FSMask(self._m, n, mask)
         else:
             self._mask = None
 
         self._compiled_input = None
+        # (unitary, input state key, output states, sampler) of the last sampled input state
+        self._output_sampler = None
 
     def _changed_unitary(self, prev_u) -> None:
         """Notify change of unitary - might be used for backend with compiled states
@@ -139,6 +143,17 @@ class Backend(ABC):
     def probampli_be(self, input_state, output_state, n=None):
         raise NotImplementedError
 
+    def _prob_distinguishable(self, input_state: BasicState, output_state: BasicState) -> float:
+        r"""Probability for fully distinguishable photons :math:`\mathrm{Perm}(|U_{s,t}|^2)/\prod_j s_j!`, where
+        :math:`U_{s,t}` repeats the rows and columns of the unitary by output and input occupations
+        """
+        if input_state.n != output_state.n:
+            return 0
+        rows = np.repeat(np.arange(self._realm), list(output_state))
+        cols = np.repeat(np.arange(self._realm), list(input_state))
+        transition = np.abs(np.asarray(self._U, dtype=complex)[np.ix_(rows, cols)])**2
+        return qc.permanent_fl(np.ascontiguousarray(transition)) / BasicState(list(output_state)).prodnfact()
+
     def prob(self,
              input_state: AnnotatedBasicState,
              output_state: AnnotatedBasicState,
@@ -153,9 +168,15 @@ class Backend(ABC):
         """
         if input_state.n == 0:
             return output_state.n == 0
+        if output_state.n != input_state.n:
+            return 0
         if self._U is None or (not self._requires_polarization and not input_state.has_polarization):
             if hasattr(input_state, "separate_state"):
                 input_states = hasattr(input_state, "separate_state") and input_state.separate_state() or [input_state]
+                if len(input_states) == input_state.n and self._U is not None and not self._use_symbolic \
+                        and self._mask is None:
+                    # fully distinguishable photons, no need to enumerate the partitions
+                    return self._prob_distinguishable(input_state, output_state)
                 all_prob = 0
                 for p_output_state in AnnotatedBasicState(output_state).partition(
                         [input_state.n for input_state in input_states]):
@@ -241,6 +262,81 @@ class Backend(ABC):
         self._realm = _realm_ref
         return prob_ampli
 
+    def _amplitudes_define_prob(self) -> bool:
+        r"""True if the probabilities of the backend are the squared moduli of its probability amplitudes - if not,
+        `prob_batch` falls back to `prob` for each pair of states
+        """
+        return True
+
+    def _batch_compatible(self, input_state: BasicState) -> bool:
+        r"""True if `input_state` can go through the batched path, i.e. it is a numeric simulation of
+        indistinguishable photons without polarization, on a backend whose amplitudes define the probabilities
+        """
+        if self._use_symbolic or not self._amplitudes_define_prob():
+            return False
+        if self._U is not None and (self._requires_polarization or input_state.has_polarization):
+            return False
+        return not isinstance(input_state, AnnotatedBasicState) or not input_state.has_annotations
+
+    def _batch_outputs(self, output_states: List[BasicState]):
+        r"""Prepare the output states once for a batch - backend specific, returned value is passed to
+        `_probampli_batch_be`
+        """
+        return None
+
+    def _probampli_batch_be(self, input_state: BasicState, output_states: List[BasicState], outputs_plan) -> np.ndarray:
+        r"""Probability amplitudes of all `output_states` for a single (compatible) `input_state`"""
+        self.compile(input_state)
+        return np.asarray([self.probampli_be(input_state, output_state) for output_state in output_states],
+                          dtype=complex)
+
+    def probampli_batch(self,
+                        input_states: List[BasicState],
+                        output_states: List[BasicState]) -> np.ndarray:
+        r"""Gives the probability amplitudes of several output states for several input states
+
+        :param input_states: the input states
+        :param output_states: the output states
+        :return: complex matrix of shape `(len(input_states), len(output_states))`
+        """
+        input_states = list(input_states)
+        output_states = list(output_states)
+        amplis = np.zeros((len(input_states), len(output_states)), dtype=self._use_symbolic and object or complex)
+        outputs_plan = None
+        for iidx, input_state in enumerate(input_states):
+            if input_state.n == 0:
+                amplis[iidx, :] = [output_state.n == 0 for output_state in output_states]
+            elif self._batch_compatible(input_state):
+                if outputs_plan is None:
+                    outputs_plan = self._batch_outputs(output_states)
+                amplis[iidx, :] = self._probampli_batch_be(input_state, output_states, outputs_plan)
+            else:
+                amplis[iidx, :] = [self.probampli(input_state, output_state) for output_state in output_states]
+        return amplis
+
+    def prob_batch(self,
+                   input_states: List[BasicState],
+                   output_states: List[BasicState]) -> np.ndarray:
+        r"""Gives the probabilities of several output states for several input states
+
+        :param input_states: the input states
+        :param output_states: the output states
+        :return: matrix of shape `(len(input_states), len(output_states))`
+        """
+        input_states = list(input_states)
+        output_states = list(output_states)
+        probs = np.zeros((len(input_states), len(output_states)), dtype=self._use_symbolic and object or float)
+        batch_idx = [iidx for iidx, input_state in enumerate(input_states)
+                     if input_state.n and self._batch_compatible(input_state)]
+        if batch_idx:
+            probs[batch_idx, :] = abs(self.probampli_batch([input_states[iidx] for iidx in batch_idx],
+                                                           output_states))**2
+        batch_idx = set(batch_idx)
+        for iidx, input_state in enumerate(input_states):
+            if iidx not in batch_idx:
+                probs[iidx, :] = [self.prob(input_state, output_state) for output_state in output_states]
+        return probs
+
     def allstateprob_iterator(self,
                               input_state: Union[AnnotatedBasicState, StateVector]) \
             -> Iterator[Tuple[AnnotatedBasicState, float]]:
@@ -250,13 +346,16 @@ class Backend(ABC):
         :return: list of (output_state, probability)
         """
         skip_compile = False
+        if isinstance(input_state, StateVector):
+            # normalized once, the components are read on each output state
+            input_state.normalize()
+            input_components = list(input_state.items())
         for output_state in self.allstate_iterator(input_state):
             if isinstance(input_state, StateVector) and len(input_state) > 1:
                 # a superposed state cannot have distinguishable particles
                 probampli = 0
-                sv = input_state
-                for inp_state in sv:
-                    probampli += self.probampli(inp_state, output_state)*sv[inp_state]
+                for inp_state, amplitude in input_components:
+                    probampli += self.probampli(inp_state, output_state)*amplitude
                 yield output_state, abs(probampli)**2
             else:
                 # TODO: should not have a special case here
@@ -265,6 +364,21 @@ class Backend(ABC):
                 yield output_state, self.prob(input_state, output_state, skip_compile=skip_compile)
                 skip_compile = True
 
+    def allstateprob_array(self, input_state: Union[AnnotatedBasicState, StateVector]) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """All possible output states compatible with mask and their probabilities, as arrays
+
+        :param input_state: a given input state
+        :return: the occupation vectors of the output states (one per row) and the probabilities, in the order of
+            `allstateprob_iterator`
+        """
+        occupations = []
+        probs = []
+        for output_state, p in self.allstateprob_iterator(input_state):
+            occupations.append(list(output_state))
+            probs.append(p)
+        return np.asarray(occupations, dtype=int).reshape(len(occupations), self.m), np.asarray(probs, dtype=float)
+
     def allstate_iterator(self, input_state: Union[AnnotatedBasicState, StateVector]) -> AnnotatedBasicState:
         """Iterator on all possible output states compatible with mask generating StateVector
 
@@ -290,11 +404,14 @@ class Backend(ABC):
         :return: the output_state
         """
         output_state = StateVector(None)
+        if isinstance(input_state, StateVector):
+            # normalized once, the output state is normalized when it is read
+            input_state.normalize()
+            input_components = list(input_state.items())
         for basic_output_state in self.allstate_iterator(input_state):
             if isinstance(input_state, StateVector):
-                sv = input_state
-                for inp_state in sv:
-                    output_state[basic_output_state] += self.probampli(inp_state, basic_output_state)*sv[inp_state]
+                for inp_state, amplitude in input_components:
+                    output_state[basic_output_state] += self.probampli(inp_state, basic_output_state)*amplitude
             else:
                 output_state[basic_output_state] += self.probampli(input_state, basic_output_state)
         return output_state
@@ -308,11 +425,34 @@ class Backend(ABC):
         """
         return False
 
+    def _sampler(self, input_state) -> Tuple[List[AnnotatedBasicState], DistributionSampler]:
+        r"""Output states and sampler on the output distribution of an input state - the distribution is computed
+        once, and kept for the next calls with the same input state and unitary
+        """
+        key = str(input_state)
+        if self._output_sampler is not None and self._U is not None \
+                and self._output_sampler[0] is self._U and self._output_sampler[1] == key:
+            return self._output_sampler[2:]
+        output_states = []
+        probs = []
+        for output_state, state_prob in self.allstateprob_iterator(input_state):
+            output_states.append(output_state)
+            probs.append(state_prob)
+        sampler = DistributionSampler(output_states, probs)
+        self._output_sampler = (self._U, key, output_states, sampler)
+        return output_states, sampler
+
     def sample(self, input_state):
-        prob = random.random()
-        output_state = None
-        for (output_state, state_prob) in self.allstateprob_iterator(input_state):
-            if state_prob >= prob:
-                return output_state
-            prob -= state_prob
-        return output_state
+        _, sampler = self._sampler(input_state)
+        return sampler.sample(1)[0]
+
+    def samples(self, input_state, count: int) -> np.ndarray:
+        r"""Generate `count` samples, from a single computation of the output distribution
+
+        :param input_state: the input state
+        :param count: number of samples
+        :return: array of shape `(count, m)`, each row is the occupation of a sample
+        """
+        output_states, sampler = self._sampler(input_state)
+        occupations = np.asarray([list(output_state) for output_state in output_states])
+        return occupations[sampler.sample_indexes(count)].astype(np.min_scalar_type(occupations.max()))
@@ -87,12 +87,19 @@ class CircuitAnalyser:
             distance with expected
         """
         self._distribution = np.zeros((len(self.input_states_list), len(self.output_states_list)))
+        # only the post-selected outputs are computed
+        selected = [oidx for oidx, ostate in enumerate(self.output_states_list)
+                    if self._post_select_fn is None or self._post_select_fn(ostate)]
+        if selected:
+            self._distribution[:, selected] = self._simulator.prob_batch(self.input_states_list,
+                                                                         [self.output_states_list[oidx]
+                                                                          for oidx in selected])
         if expected is not None:
             self._expected_distribution = np.zeros((len(self.input_states_list), len(self.output_states_list)))
             self.performance = 1
             self.error_rate = 0
         for iidx, istate in enumerate(self.input_states_list):
-            sump = 1e-6
+            sump = 1e-6 + self._distribution[iidx, :].sum()
             if expected is not None:
                 if istate in expected:
                     expected_o = expected[istate]
@@ -103,16 +110,12 @@ class CircuitAnalyser:
                         if v == expected_o:
                             expected_o = k
                             break
-                self._expected_distribution[iidx, self.output_states_list.index(expected_o)] = 1
-            for oidx, ostate in enumerate(self.output_states_list):
-                if self._post_select_fn is None or self._post_select_fn(ostate):
-                    if istate.n == ostate.n:
-                        self._distribution[iidx, oidx] = self._simulator.prob(istate, ostate)
-                        if expected is not None and self._expected_distribution[iidx, oidx]:
-                            found_in_row = self._distribution[iidx, oidx]
-                            if self._distribution[iidx, oidx] < self.performance:
-                                self.performance = self._distribution[iidx, oidx]
-                    sump += self._distribution[iidx, oidx]
+                oidx = self.output_states_list.index(expected_o)
+                self._expected_distribution[iidx, oidx] = 1
+                found_in_row = self._distribution[iidx, oidx]
+                if (self._post_select_fn is None or self._post_select_fn(expected_o)) and istate.n == expected_o.n \
+                        and found_in_row < self.performance:
+                    self.performance = found_in_row
             if normalize or expected is not None:
                 self._distribution[iidx, :] /= sump
             if expected is not None:
@@ -20,8 +20,145 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-class Detector():
-    def __init__(self):
+from __future__ import annotations
+
+from collections import OrderedDict
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class Detector:
+    r"""Detector model: the response is the probability of each outcome given the number of photons
+
+    * photon-number resolving (PNR): the outcome is the number of photons
+    * threshold: the outcome is 1 (click) if there is at least one photon, 0 otherwise
+    * pseudo-PNR: the photons are spread uniformly over `n_pixels` threshold pixels, the outcome is the number of
+      clicking pixels
+    """
+    def __init__(self, max_count: Optional[int] = None, n_pixels: Optional[int] = None):
+        r"""
+        :param max_count: saturation of the outcome, 1 for a threshold detector, None for a PNR detector
+        :param n_pixels: number of threshold pixels of a pseudo-PNR detector
+        """
+        assert max_count is None or max_count >= 1, "max_count should be at least 1"
+        assert n_pixels is None or n_pixels >= 1, "n_pixels should be at least 1"
+        self.max_count = max_count
+        self.n_pixels = n_pixels
+
+    @staticmethod
+    def pnr() -> Detector:
+        return Detector()
+
+    @staticmethod
+    def threshold() -> Detector:
+        return Detector(max_count=1)
+
+    @staticmethod
+    def pseudo_pnr(n_pixels: int) -> Detector:
+        return Detector(n_pixels=n_pixels)
+
+    @property
+    def deterministic(self) -> bool:
+        r"""True if the outcome is a function of the number of photons"""
+        return self.n_pixels is None or self.n_pixels == 1
+
+    def outcome(self, n: int) -> int:
+        r"""Outcome of a deterministic detector for `n` photons"""
+        assert self.deterministic, "the outcome of a pseudo-PNR detector is probabilistic"
+        max_count = 1 if self.n_pixels == 1 else self.max_count
+        return n if max_count is None else min(n, max_count)
+
+    def response(self, n: int) -> np.ndarray:
+        r"""Probabilities of the outcomes :math:`0..n` for `n` photons
+
+        For a pseudo-PNR detector, :math:`k` pixels click with probability
+        :math:`\binom{p}{k}k!\,S(n,k)/p^n` where :math:`S` is the Stirling number of the second kind.
         """
-            definition of a detector
+        response = np.zeros(n+1)
+        if self.deterministic:
+            response[self.outcome(n)] = 1
+            return response
+        p = self.n_pixels
+        for k in range(min(n, p)+1):
+            response[k] = math.comb(p, k) * _surjections(n, k) / p**n
+        if self.max_count is not None and self.max_count < n:
+            response[self.max_count] += response[self.max_count+1:].sum()
+            response[self.max_count+1:] = 0
+        return response
+
+
+def _surjections(n: int, k: int) -> int:
+    # number of surjections from n photons onto k pixels, k! S(n, k)
+    return sum((-1)**j * math.comb(k, j) * (k-j)**n for j in range(k+1))
+
+
+_INDEX_CACHE_SIZE = 8
+"number of output state arrays whose pattern index is kept by a DetectorArray"
+
+
+class DetectorArray:
+    r"""Detectors on the output modes, aggregating output distributions into detection patterns
+
+    For deterministic detectors, the index from the output states to the patterns is computed once per array of output
+    states, and the aggregation is a `bincount`.
+    """
+    def __init__(self, m: int, detectors: Dict[int, Detector]):
+        r"""
+        :param m: number of modes
+        :param detectors: detector of each mode, the modes without detector are photon-number resolved
+        """
+        assert all(0 <= k < m for k in detectors), "invalid detector mode"
+        self._m = m
+        self._detectors = [detectors.get(k, None) for k in range(m)]
+        # id of the occupation array -> (array, patterns, pattern index), for the most recently used arrays
+        self._index_cache = OrderedDict()
+
+    @property
+    def deterministic(self) -> bool:
+        return all(detector is None or detector.deterministic for detector in self._detectors)
+
+    def _index(self, occupations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # patterns and pattern index of each output state, kept for the next calls on the same array
+        cached = self._index_cache.get(id(occupations))
+        if cached is not None and cached[0] is occupations:
+            self._index_cache.move_to_end(id(occupations))
+            return cached[1:]
+        max_n = int(occupations.max()) if occupations.size else 0
+        outcomes = occupations.copy()
+        for k, detector in enumerate(self._detectors):
+            if detector is not None:
+                table = np.asarray([detector.outcome(n) for n in range(max_n+1)], dtype=occupations.dtype)
+                outcomes[:, k] = table[occupations[:, k]]
+        patterns, inverse = np.unique(outcomes, axis=0, return_inverse=True)
+        self._index_cache[id(occupations)] = (occupations, patterns, inverse.reshape(-1))
+        if len(self._index_cache) > _INDEX_CACHE_SIZE:
+            self._index_cache.popitem(last=False)
+        return patterns, inverse.reshape(-1)
+
+    def detect(self, occupations: np.ndarray, probs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        r"""Distribution of the detection patterns
+
+        :param occupations: the output states, one occupation vector per row
+        :param probs: the probability of each output state
+        :return: the patterns, one per row, and their probabilities
         """
+        if self.deterministic:
+            patterns, inverse = self._index(occupations)
+            return patterns, np.bincount(inverse, weights=probs, minlength=len(patterns))
+        # probabilistic detectors: each state spreads over the outcomes of its modes, one mode after the other
+        max_n = int(occupations.max()) if occupations.size else 0
+        outcomes, weights = occupations, np.asarray(probs, dtype=float)
+        for k, detector in enumerate(self._detectors):
+            if detector is None:
+                continue
+            responses = np.zeros((max_n+1, max_n+1))
+            for n in range(max_n+1):
+                responses[n, :n+1] = detector.response(n)
+            rows, clicks = np.nonzero(responses[outcomes[:, k]])
+            outcomes = outcomes[rows]
+            weights = weights[rows] * responses[outcomes[:, k], clicks]
+            outcomes[:, k] = clicks
+        patterns, inverse = np.unique(outcomes, axis=0, return_inverse=True)
+        return patterns, np.bincount(inverse.reshape(-1), weights=weights, minlength=len(patterns))
@@ -24,27 +24,33 @@ from collections import defaultdict
 import copy
 from .source import Source
 from .circuit import ACircuit
-from perceval.utils import SVDistribution, StateVector
+from .detector import Detector, DetectorArray
+from perceval.utils import SVDistribution, StateVector, BasicState, PostSelect
 from perceval.backends import Backend
 import quandelibc as qc
-from typing import Dict, Callable, Type
+from typing import Dict, Callable, Type, Optional
 
 
 class Processor:
     """
         Generic definition of processor as sources + circuit
     """
-    def __init__(self, sources: Dict[int, Source], circuit: ACircuit, post_select_fn: Callable = None):
+    def __init__(self, sources: Dict[int, Source], circuit: ACircuit, post_select_fn: Callable = None,
+                 detectors: Optional[Dict[int, Detector]] = None):
         r"""Define a processor with sources connected to the circuit and possible post_selection
 
         :param sources: a list of Source used by the processor
         :param circuit: a circuit define the processor internal logic
-        :param post_select_fn: a post-selection function
+        :param post_select_fn: a post-selection function - with a `PostSelect`, the rejected states are not computed
+        :param detectors: the detector of each output mode, the modes without detector are photon-number resolved -
+            the outputs are then the detection patterns, and the post-selection applies to the patterns
         """
         self._sources = sources
         self._circuit = circuit
         self._post_select = post_select_fn
+        self._detectors = detectors and DetectorArray(circuit.m, detectors) or None
         self._inputs_map = None
+        self._simulators = {}
         for k in range(circuit.m):
             if k in sources:
                 distribution = sources[k].probability_distribution()
@@ -60,15 +66,49 @@ class Processor:
     def source_distribution(self):
         return self._inputs_map
 
+    def _get_simulator(self, simulator_backend: Type[Backend], u, input_state: StateVector) -> Optional[Backend]:
+        r"""Simulator for an input state: with a `PostSelect`, there is one masked simulator per number of photons
+        """
+        n = None
+        # a PostSelect mask is on photon counts, not on detection patterns
+        if isinstance(self._post_select, PostSelect) and len(input_state.n) == 1 and self._detectors is None:
+            n = input_state.n[0]
+        sim = self._simulators.get(n)
+        if type(sim) is simulator_backend and sim.U.shape == u.shape:
+            if sim.U is not u:
+                # keep what the backend has already compiled, only the unitary changes
+                sim.U = u
+            return sim
+        if n is None:
+            sim = simulator_backend(u)
+        else:
+            mask = self._post_select.mask(self._circuit.m, n)
+            if mask is None:
+                return None
+            sim = simulator_backend(u, n=n, mask=mask)
+        self._simulators[n] = sim
+        return sim
+
     def run(self, simulator_backend: Type[Backend]):
         """
             calculate the output probabilities - returns performance, and output_maps
         """
         # first generate all possible outputs
-        sim = simulator_backend(self._circuit.compute_unitary(use_symbolic=False))
+        u = self._circuit.compute_unitary(use_symbolic=False)
         # now generate all possible outputs
         outputs = SVDistribution()
         for input_state, input_prob in self._inputs_map.items():
+            sim = self._get_simulator(simulator_backend, u, input_state)
+            if sim is None:
+                # none of the outputs can be post-selected
+                continue
+            if self._detectors is not None:
+                patterns, probs = self._detectors.detect(*sim.allstateprob_array(input_state))
+                for pattern, p in zip(patterns.tolist(), probs):
+                    pattern = BasicState(pattern)
+                    if p and (not self._post_select or self._post_select(pattern)):
+                        outputs[StateVector(pattern)] += p*input_prob
+                continue
             for (output_state, p) in sim.allstateprob_iterator(input_state):
                 if p and (not self._post_select or self._post_select(output_state)):
                     outputs[StateVector(output_state)] += p*input_prob
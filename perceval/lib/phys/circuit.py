@@ -46,9 +46,14 @@ class BS(ACircuit):
     _fcircuit = Circuit
     stroke_style = {"stroke": "darkred", "stroke_width": 3}
 
-    def __init__(self, R=None, theta=None, phi_a=0, phi_b=3*sp.pi/2, phi_d=sp.pi):
+    def __init__(self, R=None, theta=None, phi_a=0, phi_b=3*sp.pi/2, phi_d=sp.pi, loss=0):
+        r"""
+        :param loss: fraction of the photons lost in each mode, the transfer matrix is then not unitary
+        """
         super().__init__(2)
         assert R is None or theta is None, "cannot set both R and theta"
+        assert 0 <= loss <= 1, "loss should be between 0 and 1"
+        self._loss = loss
         self._phi_a = self._set_parameter("phi_a", phi_a, 0, 2*sp.pi)
         self._phi_b = self._set_parameter("phi_b", phi_b, 0, 2*sp.pi)
         self._phi_d = self._set_parameter("phi_d", phi_d, 0, 2*sp.pi)
@@ -69,8 +74,11 @@ class BS(ACircuit):
                 cos_theta = sp.cos(self._theta.spv)
                 sin_theta = sp.sin(self._theta.spv)
             phi_c = - self._phi_b.spv + self._phi_d.spv + self._phi_a.spv
-            return Matrix([[cos_theta*sp.exp(self._phi_a.spv*sp.I), sin_theta*sp.exp(self._phi_b.spv*sp.I)*sp.I],
-                           [sin_theta*sp.exp(phi_c*sp.I)*sp.I, cos_theta*sp.exp(self._phi_d.spv*sp.I)]], True)
+            u = Matrix([[cos_theta*sp.exp(self._phi_a.spv*sp.I), sin_theta*sp.exp(self._phi_b.spv*sp.I)*sp.I],
+                        [sin_theta*sp.exp(phi_c*sp.I)*sp.I, cos_theta*sp.exp(self._phi_d.spv*sp.I)]], True)
+            if self._loss:
+                u = Matrix(u * sp.sqrt(1 - sp.S(self._loss)), True)
+            return u
         else:
             if "R" in self.params:
                 cos_theta = np.sqrt(float(self._R))
@@ -79,10 +87,11 @@ class BS(ACircuit):
                 cos_theta = np.cos(float(self._theta))
                 sin_theta = np.sin(float(self._theta))
             phi_c = - float(self._phi_b) + float(self._phi_d) + float(self._phi_a)
-            return Matrix([[cos_theta*(np.cos(float(self._phi_a)) + 1j * np.sin(float(self._phi_a))),
+            return Matrix(np.sqrt(1 - self._loss) * np.array(
+                          [[cos_theta*(np.cos(float(self._phi_a)) + 1j * np.sin(float(self._phi_a))),
                             sin_theta*(1j * np.cos(float(self._phi_b)) - np.sin(float(self._phi_b)))],
                            [sin_theta*(1j * np.cos(float(phi_c)) - np.sin(float(phi_c))),
-                            cos_theta*(np.cos(float(self._phi_d)) + 1j * np.sin(float(self._phi_d)))]], False)
+                            cos_theta*(np.cos(float(self._phi_d)) + 1j * np.sin(float(self._phi_d)))]]), False)
 
 
     def get_variables(self, map_param_kid=None):
@@ -101,6 +110,8 @@ class BS(ACircuit):
     def describe(self, map_param_kid=None):
         parameters = self.get_variables(map_param_kid)
         params_str = prepare_for_display(parameters, separator=', ')
+        if self._loss:
+            params_str += ", loss=%s" % self._loss
         return "phys.BS(%s)" % params_str
 
     width = 2
@@ -173,16 +184,24 @@ class PS(ACircuit):
     _fcircuit = Circuit
     stroke_style = {"stroke": "darkred", "stroke_width": 3}
 
-    def __init__(self, phi):
+    def __init__(self, phi, loss=0):
+        r"""
+        :param loss: fraction of the photons lost, the transfer matrix is then not unitary
+        """
         super().__init__(1)
+        assert 0 <= loss <= 1, "loss should be between 0 and 1"
+        self._loss = loss
         self._phi = self._set_parameter("phi", phi, 0, 2*sp.pi)
 
     def _compute_unitary(self, assign=None, use_symbolic=False):
         self.assign(assign)
         if use_symbolic:
+            if self._loss:
+                return Matrix([[sp.sqrt(1 - sp.S(self._loss))*sp.exp(self._phi.spv*sp.I)]], True)
             return Matrix([[sp.exp(self._phi.spv*sp.I)]], True)
         else:
-            return Matrix([[np.cos(float(self._phi)) + 1j * np.sin(float(self._phi))]], False)
+            return Matrix([[np.sqrt(1 - self._loss)*(np.cos(float(self._phi)) + 1j * np.sin(float(self._phi)))]],
+                          False)
 
     def get_variables(self, map_param_kid=None):
         parameters = {}
@@ -194,6 +213,8 @@ class PS(ACircuit):
     def describe(self, map_param_kid=None):
         parameters = self.get_variables(map_param_kid)
         params_str = prepare_for_display(parameters, separator=', ')
+        if self._loss:
+            params_str += ", loss=%s" % self._loss
         return "phys.PS(%s)" % params_str
 
     width = 1
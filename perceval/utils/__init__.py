@@ -26,6 +26,8 @@ from .qprinter import QPrinter, prepare_for_display
 from .parameter import Parameter, P
 from .utils import pdisplay, global_params, random_seed
 from .mlstr import mlstr
-from .statevector import BasicState, AnnotatedBasicState, StateVector, SVDistribution
+from .statevector import BasicState, AnnotatedBasicState, StateVector, SVDistribution, SVTimeSequence
+from .sampler import DistributionSampler
+from .postselect import PostSelect
 from .polarization import Polarization
 from .renderer import *
@@ -320,3 +320,33 @@ class MatrixN(np.ndarray, Matrix):
         :return:
         """
         return np.linalg.inv(self)
+
+
+def loss_dilation(t: np.ndarray, precision: float = 1e-8) -> np.ndarray:
+    r"""Isometry having the transfer matrix of a lossy circuit as its first rows
+
+    The extra rows are the loss channels: with :math:`I-t^\dagger t = V\Lambda V^\dagger`, they are
+    :math:`\sqrt{\Lambda_r}V_r^\dagger` for the :math:`r` non-zero eigenvalues, so that a lossless circuit gets no
+    extra row, and losses on a few modes only a few.
+
+    :param t: the :math:`m \times m` transfer matrix, with singular values at most 1
+    :param precision: eigenvalues below `precision` are ignored
+    :return: the :math:`(m+r) \times m` isometry
+    """
+    t = np.asarray(t, dtype=complex)
+    eigenvalues, eigenvectors = np.linalg.eigh(np.eye(t.shape[1]) - t.T.conj() @ t)
+    assert eigenvalues.min() > -precision, "transfer matrix should have singular values at most 1"
+    lossy = eigenvalues > precision
+    return np.vstack([t, np.sqrt(eigenvalues[lossy])[:, np.newaxis] * eigenvectors[:, lossy].T.conj()])
+
+
+def unitary_completion(w: np.ndarray) -> np.ndarray:
+    r"""Unitary matrix having the isometry `w` as its first columns
+
+    :param w: a :math:`p \times m` matrix with orthonormal columns
+    :return: the :math:`p \times p` unitary
+    """
+    w = np.asarray(w, dtype=complex)
+    # the left singular vectors beyond the rank of w span the orthogonal complement of its columns
+    u, _, _ = np.linalg.svd(w, full_matrices=True)
+    return np.hstack([w, u[:, w.shape[1]:]])
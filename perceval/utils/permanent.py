@@ -0,0 +1,82 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+from typing import Sequence
+
+import numpy as np
+
+
+def glynn_terms(multiplicities: Sequence[int]) -> int:
+    r"""Number of terms of the Glynn formula with repeated rows, for the given row multiplicities"""
+    multiplicities = [mult for mult in multiplicities if mult]
+    if not multiplicities:
+        return 1
+    return multiplicities[0] * math.prod(mult + 1 for mult in multiplicities[1:])
+
+
+def permanent_multiplicities(a: np.ndarray, row_mult: Sequence[int], col_mult: Sequence[int],
+                             chunk_size: int = 1 << 14) -> complex:
+    r"""Permanent of the matrix built by repeating `row_mult[i]` times the row `i` of `a`, and `col_mult[j]` times
+    the column `j`
+
+    Glynn formula where the sign vectors are grouped by repeated row: the sum runs on the number :math:`v_i` of minus
+    signs for each distinct row, weighted by binomial coefficients, which needs :math:`\prod_i(\mu_i+1)` terms
+    instead of :math:`2^{n-1}`. Repeated columns are powers in the product. The side with fewer terms is used.
+
+    :param a: the matrix of the distinct rows and columns
+    :param row_mult: multiplicity of each row, sums to `n`
+    :param col_mult: multiplicity of each column, sums to `n`
+    :param chunk_size: number of terms evaluated at once
+    :return: the permanent of the :math:`n \times n` matrix
+    """
+    a = np.asarray(a, dtype=complex)
+    row_mult = np.asarray(row_mult, dtype=int)
+    col_mult = np.asarray(col_mult, dtype=int)
+    assert row_mult.sum() == col_mult.sum(), "the expanded matrix should be square"
+    if glynn_terms(col_mult) < glynn_terms(row_mult):
+        a, row_mult, col_mult = a.T, col_mult, row_mult
+    rows = row_mult > 0
+    a, row_mult = a[rows], row_mult[rows]
+    n = int(row_mult.sum())
+    if n == 0:
+        return 1
+    # sign count v_i ranges on 0..mu_i, the first copy of the first row always has a + sign
+    radix = row_mult + 1
+    radix[0] -= 1
+    available = row_mult.copy()
+    available[0] -= 1
+    total = int(np.prod(radix))
+    # binomial coefficients C(available_i, v) for every row and v
+    binomials = np.zeros((len(row_mult), radix.max()))
+    for i, mu in enumerate(available):
+        binomials[i, :mu+1] = [math.comb(int(mu), v) for v in range(mu+1)]
+    perm = 0
+    for start in range(0, total, chunk_size):
+        idx = np.arange(start, min(start+chunk_size, total))
+        v = np.empty((len(idx), len(row_mult)), dtype=int)
+        for i, r in enumerate(radix):
+            idx, v[:, i] = np.divmod(idx, r)
+        weights = np.where(v.sum(axis=1) % 2, -1., 1.) * np.prod(binomials[np.arange(len(row_mult)), v], axis=1)
+        sums = (row_mult - 2*v) @ a
+        perm += np.dot(weights, np.prod(sums ** col_mult, axis=1))
+    return perm / 2**(n-1)
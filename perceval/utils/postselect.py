@@ -0,0 +1,82 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from __future__ import annotations
+
+import itertools
+from typing import Dict, Iterable, List, Optional, Union
+
+from .statevector import BasicState
+
+
+class PostSelect:
+    r"""Declarative post-selection on the photon counts of the output modes
+
+    A `PostSelect` is both a post-selection function (callable on a state) and a specification that compiles into a
+    backend mask, so that rejected states are never computed.
+
+    >>> heralded = PostSelect({2: 0, 3: 1})            # heralding pattern: no photon in mode 2, one in mode 3
+    >>> dual_rail = PostSelect({0: (0, 1), 1: (0, 1)})  # at most one photon in modes 0 and 1
+    >>> either = heralded | dual_rail                 # any of the two
+    """
+
+    def __init__(self, constraints: Dict[int, Union[int, Iterable[int]]] = None):
+        r"""
+        :param constraints: for each constrained mode, the accepted photon count or counts
+        """
+        alternative = {}
+        for k, counts in (constraints or {}).items():
+            alternative[k] = isinstance(counts, int) and (counts,) or tuple(sorted(set(counts)))
+        self._alternatives = [alternative]
+
+    def __or__(self, other: PostSelect) -> PostSelect:
+        r"""Post-selection accepting the states accepted by any of the two post-selections"""
+        ps = PostSelect()
+        ps._alternatives = self._alternatives + other._alternatives
+        return ps
+
+    def __call__(self, state: BasicState) -> bool:
+        for alternative in self._alternatives:
+            if all(state[k] in counts for k, counts in alternative.items()):
+                return True
+        return False
+
+    def mask(self, m: int, n: int) -> Optional[List[str]]:
+        r"""Compile the post-selection into mask conditions for states with `n` photons in `m` modes
+
+        :return: the mask conditions, or None if no state with `n` photons is accepted
+        """
+        conditions = []
+        for alternative in self._alternatives:
+            modes = sorted(alternative)
+            for counts in itertools.product(*[alternative[k] for k in modes]):
+                if sum(counts) > n:
+                    continue
+                if max(counts, default=0) > 9:
+                    raise ValueError("mask conditions support up to 9 photons per mode")
+                condition = [" "] * m
+                for k, count in zip(modes, counts):
+                    condition[k] = str(count)
+                condition = "".join(condition)
+                if condition not in conditions:
+                    conditions.append(condition)
+        return conditions or None
@@ -0,0 +1,69 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from typing import Any, List, Sequence
+
+import numpy as np
+
+
+class DistributionSampler:
+    r"""Sampler on a discrete distribution, built once and drawing in :math:`O(\log N)`
+
+    The cumulative probabilities are computed at construction, each draw is a `searchsorted` on a uniform number, and
+    `k` draws are vectorized. The probabilities do not need to be normalized.
+
+    >>> sampler = DistributionSampler(["a", "b", "c"], [0.5, 0.25, 0.25])
+    >>> sampler.sample(3)
+    ['a', 'c', 'a']
+    """
+    def __init__(self, items: Sequence[Any], probabilities: Sequence[float]):
+        r"""
+        :param items: the items to sample
+        :param probabilities: the (not necessarily normalized) probability of each item
+        """
+        assert len(items) == len(probabilities), "one probability per item is required"
+        self._items = items
+        self._cumulative = np.cumsum(np.asarray(probabilities, dtype=float))
+        assert len(self._cumulative) and self._cumulative[-1] > 0, "cannot sample from a null distribution"
+
+    @property
+    def total(self) -> float:
+        r"""Sum of the probabilities of the items"""
+        return float(self._cumulative[-1])
+
+    def sample_indexes(self, k: int) -> np.ndarray:
+        r"""Draw `k` item indexes
+
+        :param k: number of draws
+        :return: the array of the indexes of the drawn items
+        """
+        indexes = self._cumulative.searchsorted(np.random.random(k) * self._cumulative[-1], side='right')
+        # rounding can put a draw past the last item
+        return np.minimum(indexes, len(self._cumulative) - 1)
+
+    def sample(self, k: int = 1) -> List[Any]:
+        r"""Draw `k` items
+
+        :param k: number of draws
+        :return: the list of the drawn items
+        """
+        return [self._items[idx] for idx in self.sample_indexes(k)]
@@ -22,17 +22,17 @@
 
 from __future__ import annotations
 
-import random
-from collections import defaultdict
+from collections import Counter, defaultdict
 from copy import copy
-import itertools
+from functools import lru_cache
 import re
-from typing import Dict, List, Union, Tuple, Optional
+from typing import Dict, Iterator, List, Union, Tuple, Optional
 
 from tabulate import tabulate
 
 from perceval.utils import simple_complex, simple_float, Matrix, global_params
 from .polarization import Polarization
+from .sampler import DistributionSampler
 import numpy as np
 import sympy as sp
 
@@ -67,6 +67,13 @@ class Annotations(dict):
         for k, v in annots.items():
             self[k] = copy(v)
 
+    @property
+    def key(self) -> tuple:
+        r"""Hashable content of the annotations, the same for equal annotations"""
+        # values without value-based hashing (polarization) are represented by their text
+        return tuple((k, v if isinstance(v, (int, float, complex, str, sp.Basic)) else str(v))
+                     for k, v in sorted(self.items(), key=lambda kv: kv[0]))
+
     @staticmethod
     def parse_annotation(s):
         l_s = s.split(",")
@@ -113,6 +120,38 @@ class Annotations(dict):
         return "{" + ",".join(represented) + "}"
 
 
+def _sub_occupations(remaining: List[int], n: int) -> Iterator[List[int]]:
+    r"""Occupation vectors with `n` photons, below `remaining` mode by mode"""
+    m = len(remaining)
+    # photons that the modes from k to the end can take
+    capacity = [0] * (m + 1)
+    for k in range(m - 1, -1, -1):
+        capacity[k] = capacity[k + 1] + remaining[k]
+    stack = [(0, n, [])]
+    while stack:
+        mode, left, current = stack.pop()
+        if mode == m:
+            yield current
+            continue
+        for count in range(max(0, left - capacity[mode + 1]), min(left, remaining[mode]) + 1):
+            stack.append((mode + 1, left - count, current + [count]))
+
+
+@lru_cache(maxsize=4096)
+def _partitions(occupations: Tuple[int, ...], distribution: Tuple[int, ...]) -> Tuple[Tuple[BasicState, ...], ...]:
+    r"""Distinct ways to take successive parts of `distribution[k]` photons out of `occupations`"""
+    partitions = []
+    stack = [(0, list(occupations), ())]
+    while stack:
+        part, remaining, states = stack.pop()
+        if part == len(distribution):
+            partitions.append(tuple(BasicState(state) for state in states))
+            continue
+        for sub in _sub_occupations(remaining, distribution[part]):
+            stack.append((part + 1, [r - c for r, c in zip(remaining, sub)], states + (sub,)))
+    return tuple(partitions)
+
+
 class AnnotatedBasicState(BasicState):
     r"""Extends `BasicState` with annotations"""
 
@@ -175,6 +214,8 @@ class AnnotatedBasicState(BasicState):
 
         super().__init__(bs)
         self._annotations = None
+        self._hash = None
+        self._separated = None
         if photon_annotations is not None:
             self._annotations = []
             for _ in range(self.n):
@@ -203,19 +244,21 @@ class AnnotatedBasicState(BasicState):
         :return: returns the current cleared object
         """
         self._annotations = None
+        self._hash = None
+        self._separated = None
         return self
 
     def get_mode_annotations(self, k: int) -> Tuple[Annotations]:
         r"""Retrieve annotations of the photons in the given mode
 
         :param k: the mode
-        :return: tuple annotation list
+        :return: tuple annotation list - copies, the annotations of the state change with `set_photon_annotations`
         """
         annots = []
         if self[k] != 0:
             photon_idx = self.mode2photon(k)
             while len(annots) < self[k]:
-                annots.append(self._annotations is not None and self._annotations[photon_idx] or Annotations({}))
+                annots.append(Annotations(self._annotations is not None and self._annotations[photon_idx] or {}))
                 photon_idx += 1
         return tuple(annots)
 
@@ -223,11 +266,11 @@ class AnnotatedBasicState(BasicState):
         r"""Retrieve annotations of the k-th photon
 
         :param pk: the photon 1-based index
-        :return: tuple annotation list
+        :return: a copy of the annotations, they change with `set_photon_annotations`
         """
         if self._annotations is None:
             return Annotations({})
-        return self._annotations[pk-1]
+        return Annotations(self._annotations[pk-1])
 
     def set_photon_annotations(self, pk: int, annots: Union[Dict, Annotations]) -> None:
         r"""Set annotations of the k-th photon (1-based index)
@@ -235,6 +278,8 @@ class AnnotatedBasicState(BasicState):
         :param pk: the photon 1-based index
         :param annots: the annotations
         """
+        self._hash = None
+        self._separated = None
         if self._annotations is None:
             self._annotations = []
             for _ in range(self.n):
@@ -246,9 +291,15 @@ class AnnotatedBasicState(BasicState):
     def separate_state(self) -> List[AnnotatedBasicState]:
         r"""Separate an `AnnotatedBasicState` on states with indistinguishable photons
 
+        The separation is kept until the annotations change, the states returned are copies of the kept ones.
+
         :return: list of `AnnotatedBasicState` - might be the current state.
         """
+        if self._separated is None:
+            self._separated = self._separate_state()
+        return [state if state is self else BasicState(state) for state in self._separated]
 
+    def _separate_state(self) -> List[AnnotatedBasicState]:
         if self.n == 0:
             return [BasicState([0]*self.m)]
 
@@ -294,31 +345,12 @@ class AnnotatedBasicState(BasicState):
     def partition(self, distribution_photons: List[int]):
         r"""Given a distribution of photon, find all possible partition of the state
 
-        :param distribution_photons:
-        :return:
+        The partitions only depend on the occupations and the distribution, they are kept in a bounded LRU cache.
+
+        :param distribution_photons: number of photons of each part
+        :return: list of tuples of `BasicState`, one state per part
         """
-        def _partition(one_list: list, distribution: list, current: list, all_res: list):
-            if len(distribution) == 0:
-                all_res.append(copy(current))
-                return
-            for one_subset in itertools.combinations(one_list, distribution[0]):
-                current.append(one_subset)
-                _partition(list(set(one_list)-set(one_subset)), distribution[1:], current, all_res)
-                current.pop()
-
-        all_photons = list(range(self.n))
-        partitions_idx = []
-        _partition(all_photons, distribution_photons, [], partitions_idx)
-        partitions_states = set()
-        for partition in partitions_idx:
-            o_state = []
-            for a_subset in partition:
-                state = [0] * self.m
-                for photon_id in a_subset:
-                    state[self.photon2mode(photon_id)] += 1
-                o_state.append(BasicState(state))
-            partitions_states.add(tuple(o_state))
-        return list(partitions_states)
+        return list(_partitions(tuple(self), tuple(distribution_photons)))
 
     def __str__(self):
         """Textual Representation of a BasicState
@@ -371,15 +403,42 @@ class AnnotatedBasicState(BasicState):
         return new_a_bs
 
     def __hash__(self):
-        if self.has_annotations:
-            return self.__str__().__hash__()
-        else:
-            return super(AnnotatedBasicState, self).__hash__()
+        if self._hash is None:
+            if self._annotations is None or not any(self._annotations):
+                self._hash = super(AnnotatedBasicState, self).__hash__()
+            else:
+                self._hash = hash(self._canonical_annotations())
+        return self._hash
 
+    def _canonical_annotations(self) -> Tuple[frozenset, ...]:
+        r"""Structural key of the annotations: for each mode, the multiset of the annotations of its photons - states
+        with the same textual representation have the same key
+        """
+        annotation_keys = [annot.key for annot in self._annotations]
+        modes = []
+        photon = 0
+        for count in list(self):
+            modes.append(frozenset(Counter(annotation_keys[photon:photon+count]).items()))
+            photon += count
+        return tuple(modes)
+
+
+def _symbolic_value(value):
+    # numeric amplitude moved to a symbolic state vector, integers stay integers as in the symbolic expressions
+    if isinstance(value, (complex, np.complexfloating)) and value.imag == 0:
+        value = value.real
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return int(value)
+    return value
 
-class StateVector(defaultdict):
+
+class StateVector:
     """
     A StateVector is a (complex) linear combination of annotated Basic States
+
+    The basis states are stored in insertion order with their hashes, and the amplitudes in an array, so that
+    additions, scaling and normalization are vectorized. The dictionary interface (`keys`, `values`, `items`,
+    item access) is a view on these arrays.
     """
 
     def __init__(self,
@@ -390,8 +449,13 @@ class StateVector(defaultdict):
                     None used for internal purpose
         :param photon_annotations: photon annotation dictionary
         """
-        super(StateVector, self).__init__(float)
         self.m = None
+        self._keys = []
+        self._positions = {}
+        self._hashes = np.empty(4, dtype=np.int64)
+        self._amplitudes = np.empty(4, dtype=complex)
+        self._has_symbolic = False
+        self._hash = None
         if bs is not None:
             if not isinstance(bs, AnnotatedBasicState):
                 bs = AnnotatedBasicState(bs, photon_annotations)
@@ -399,7 +463,28 @@ class StateVector(defaultdict):
                 assert photon_annotations is None, "cannot add photon annotations to AnnotatedBasicState"
             self[bs] = 1
         self._normalized = True
-        self._has_symbolic = False
+
+    def _to_symbolic(self) -> None:
+        if not self._has_symbolic:
+            self._amplitudes = np.asarray([_symbolic_value(v) for v in self._amplitudes] or [], dtype=object)
+            self._has_symbolic = True
+
+    def _reserve(self, size: int) -> None:
+        if size > len(self._amplitudes):
+            capacity = max(size, 2*len(self._amplitudes))
+            self._hashes = np.resize(self._hashes, capacity)
+            self._amplitudes = np.resize(self._amplitudes, capacity)
+
+    @property
+    def amplitudes(self) -> np.ndarray:
+        r"""Amplitudes of the basis states, in the order of `keys` (no normalization)"""
+        return self._amplitudes[:len(self._keys)]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._positions
 
     def __rmul__(self, other):
         r"""Multiply a StateVector by a numeric value, right side
@@ -408,40 +493,95 @@ class StateVector(defaultdict):
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            return list(self.keys())[key]
+            return self._keys[key]
         assert isinstance(key, BasicState), "SVState keys should be (annotated) basic states"
-        return super().__getitem__(key)
+        pos = self._positions.get(key)
+        if pos is None:
+            return 0
+        return self._amplitudes[pos]
+
+    def get(self, key, default=None):
+        pos = self._positions.get(key)
+        if pos is None:
+            return default
+        return self._amplitudes[pos]
 
     def __setitem__(self, key, value):
         assert isinstance(key, BasicState), "SVState keys should be (annotated) basic states"
         self._normalized = False
+        self._hash = None
         if self.m is None:
             self.m = key.m
-        return super().__setitem__(key, value)
+        if isinstance(value, sp.Expr):
+            self._to_symbolic()
+        elif self._has_symbolic:
+            value = _symbolic_value(value)
+        pos = self._positions.get(key)
+        if pos is None:
+            pos = len(self._keys)
+            self._reserve(pos + 1)
+            self._keys.append(key)
+            self._positions[key] = pos
+            self._hashes[pos] = hash(key)
+        self._amplitudes[pos] = value
+
+    def __delitem__(self, key):
+        pos = self._positions[key]
+        self._keep(np.arange(len(self._keys)) != pos)
+
+    def _keep(self, mask: np.ndarray) -> None:
+        # only keeps the basis states selected by the mask
+        size = len(self._keys)
+        self._keys = [key for key, kept in zip(self._keys, mask.tolist()) if kept]
+        self._positions = {key: pos for pos, key in enumerate(self._keys)}
+        self._hashes = self._hashes[:size][mask]
+        self._amplitudes = self._amplitudes[:size][mask]
+        self._hash = None
 
     def __iter__(self):
-        self._normalize()
-        return super().__iter__()
+        return self.iterate()
+
+    def iterate(self, normalize: bool = True) -> Iterator[BasicState]:
+        r"""Iterator on the basis states
+
+        :param normalize: if False, the pending normalization is not applied - the raw mode for loops that keep
+            updating the state vector
+        """
+        if normalize:
+            self.normalize()
+            return iter(self._keys)
+        # snapshot of the basis states, the state vector can be updated during the iteration
+        return iter(list(self._keys))
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self.amplitudes)
+
+    def items(self):
+        return zip(list(self._keys), list(self.amplitudes))
 
     def __mul__(self, other):
         r"""Multiply a StateVector by a numeric value prior in a linear combination
         """
         assert isinstance(other, (int, float, complex, np.number, sp.Expr)), "normalization factor has to be numeric"
-        copy_state = StateVector(None)
         # multiplying - the outcome is a non-normalized StateVector
-        for state, amplitude in self.items():
-            copy_state[state] = amplitude*other
+        copy_state = copy(self)
+        if isinstance(other, sp.Expr):
+            copy_state._to_symbolic()
+        copy_state._amplitudes[:len(copy_state)] *= other
         if other != 1:
             copy_state._normalized = False
-        copy_state.m = self.m
-        if isinstance(other, sp.Expr):
-            self._has_symbolic = True
         return copy_state
 
     def __copy__(self):
         sv_copy = StateVector(None)
-        for k, v in self.items():
-            sv_copy[k] = v
+        size = len(self._keys)
+        sv_copy._keys = list(self._keys)
+        sv_copy._positions = dict(self._positions)
+        sv_copy._hashes = self._hashes[:size].copy()
+        sv_copy._amplitudes = self._amplitudes[:size].copy()
         sv_copy._has_symbolic = self._has_symbolic
         sv_copy._normalized = self._normalized
         sv_copy.m = self.m
@@ -454,50 +594,88 @@ class StateVector(defaultdict):
         copy_state = copy(self)
         if not isinstance(other, StateVector):
             other = StateVector(other)
-        # multiplying - the outcome is a non-normalized StateVector
-        for state, amplitude in other.items():
-            if state not in copy_state:
-                copy_state[state] = amplitude
-            else:
-                copy_state[state] += amplitude
-        copy_state._normalized = False
-        copy_state.m = self.m
         if other._has_symbolic:
-            copy_state._has_symbolic = True
+            copy_state._to_symbolic()
+        size = len(copy_state)
+        other_amplitudes = other.amplitudes
+        if copy_state._has_symbolic and not other._has_symbolic:
+            # numeric amplitudes join the symbolic expressions as exact values
+            other_amplitudes = np.asarray([_symbolic_value(v) for v in other_amplitudes] or [], dtype=object)
+        other_hashes = other._hashes[:len(other)]
+        # position of each state of other in the copy, -1 for the new states - matched on the hashes, then checked
+        positions = np.full(len(other), -1)
+        if size:
+            order = np.argsort(copy_state._hashes[:size])
+            found = order[np.minimum(np.searchsorted(copy_state._hashes[:size], other_hashes, sorter=order), size-1)]
+            positions = np.where(copy_state._hashes[found] == other_hashes, found, -1)
+            for idx in np.flatnonzero(positions >= 0).tolist():
+                key, other_key = copy_state._keys[positions[idx]], other._keys[idx]
+                if key is not other_key and key != other_key:
+                    # hash collision
+                    positions[idx] = copy_state._positions.get(other_key, -1)
+        shared = positions >= 0
+        np.add.at(copy_state._amplitudes, positions[shared], other_amplitudes[shared])
+        added = np.flatnonzero(~shared)
+        copy_state._reserve(size + len(added))
+        copy_state._hashes[size:size+len(added)] = other_hashes[added]
+        copy_state._amplitudes[size:size+len(added)] = other_amplitudes[added]
+        for pos, idx in enumerate(added.tolist(), size):
+            key = other._keys[idx]
+            copy_state._keys.append(key)
+            copy_state._positions[key] = pos
+        copy_state._normalized = False
         return copy_state
 
     def __sub__(self, other):
         r"""Sub two StateVectors"""
         return self + -1 * other
 
+    def __eq__(self, other):
+        if not isinstance(other, StateVector):
+            return False
+        if len(self) != len(other):
+            return False
+        positions = [other._positions.get(key) for key in self._keys]
+        if None in positions:
+            return False
+        return all(self.amplitudes == other._amplitudes[positions])
+
     @property
     def n(self):
         r"""list the possible values of n in the different states"""
-        return list(set([st.n for st in self.keys()]))
-
-    def _normalize(self):
-        r"""Normalize a non-normalized state"""
-        if not self._normalized:
-            norm = 0
-            to_remove = []
-            for key in self.keys():
-                if (isinstance(self[key], (complex, float, int))
-                        and abs(self[key]) < global_params["min_complex_component"]) or self[key] == 0:
-                    to_remove.append(key)
-                else:
-                    norm += abs(self[key])**2
-            for key in to_remove:
-                del self[key]
-            norm = norm**0.5
-            for key in self.keys():
-                if len(self) == 1:
-                    self[key] = 1
-                else:
-                    self[key] /= norm
-            self._normalized = True
+        return list(set([st.n for st in self._keys]))
+
+    def normalize(self) -> None:
+        r"""Normalize the state vector, removing the negligible components
+
+        The updates only mark the state vector as non-normalized, the normalization runs once on all the amplitudes
+        when the normalized state vector is needed (iteration, text representation, hash) or on this explicit call.
+        """
+        if self._normalized:
+            return
+        amplitudes = self.amplitudes
+        if self._has_symbolic:
+            keep = np.asarray([not ((isinstance(v, (complex, float, int))
+                                     and abs(v) < global_params["min_complex_component"]) or v == 0)
+                               for v in amplitudes], dtype=bool)
+        else:
+            keep = np.abs(amplitudes) >= global_params["min_complex_component"]
+        if not keep.all():
+            self._keep(keep)
+            amplitudes = self.amplitudes
+        if len(self) == 1:
+            amplitudes[0] = 1
+        elif len(self):
+            if self._has_symbolic:
+                norm = sum(abs(v)**2 for v in amplitudes)**0.5
+            else:
+                norm = np.sqrt(np.sum(np.abs(amplitudes)**2))
+            amplitudes /= norm
+        self._hash = None
+        self._normalized = True
 
     def __str__(self):
-        self._normalize()
+        self.normalize()
         ls = []
         for key, value in self.items():
             if value == 1:
@@ -510,15 +688,94 @@ class StateVector(defaultdict):
         return "+".join(ls).replace("+-", "-")
 
     def __hash__(self):
-        return self.__str__().__hash__()
+        # equal state vectors have the same basis states and amplitudes, in any order
+        self.normalize()
+        if self._hash is None:
+            self._hash = hash(frozenset(zip(self._hashes[:len(self)].tolist(), self.amplitudes.tolist())))
+        return self._hash
 
 
 class SVTimeSequence:
-    r"""Sequence in time of state-vector
+    r"""Sequence in time of state-vector: a source emits the same state at each period of a window, and the photons
+    of all the periods evolve together through the circuit
+
+    The superposition is stored as arrays - `occupations` has one row per basis state, with the occupation of the modes
+    of period 0, then period 1, ..., and `amplitudes` the amplitude of each row. The photons delayed beyond the window
+    leave it: as no component acts on them anymore, their time-bins are dropped and only a label of what left the
+    window is kept in the last column, so that the basis states stay distinct.
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, sv: Union[BasicState, StateVector], window: int):
+        r"""
+        :param sv: the state emitted at each period
+        :param window: number of periods
+        """
+        assert window >= 1, "the window should have at least one period"
+        if isinstance(sv, BasicState):
+            sv = StateVector(sv)
+        states = list(sv)
+        assert not any(state.has_annotations for state in states), "time sequences do not support annotated states"
+        self._m = sv.m
+        self._window = window
+        period_occupations = np.asarray([list(state) for state in states], dtype=int).reshape(len(states), self._m)
+        period_amplitudes = np.array(sv.amplitudes, dtype=complex)
+        # tensor product of the state of each period
+        occupations = np.zeros((1, 0), dtype=int)
+        amplitudes = np.ones(1, dtype=complex)
+        for _ in range(window):
+            occupations = np.concatenate([np.repeat(occupations, len(states), axis=0),
+                                          np.tile(period_occupations, (len(occupations), 1))], axis=1)
+            amplitudes = np.repeat(amplitudes, len(states)) * np.tile(period_amplitudes, len(amplitudes))
+        self.occupations = np.concatenate([occupations, np.zeros((len(occupations), 1), dtype=int)], axis=1)
+        self.amplitudes = amplitudes
+
+    @property
+    def m(self) -> int:
+        return self._m
+
+    @property
+    def window(self) -> int:
+        return self._window
+
+    def modes(self, period: int, modes: List[int]) -> List[int]:
+        r"""Columns of `occupations` for some modes of a period"""
+        assert 0 <= period < self._window, "period out of the window"
+        return [period*self._m + k for k in modes]
+
+    def apply_delta_t(self, mode: int, dt: float) -> None:
+        r"""Delay the photons of a mode by `dt` periods
+
+        :param mode: the delayed mode
+        :param dt: the delay, a whole number of periods
+        """
+        shift = int(dt)
+        assert shift == dt and shift >= 0, "only delays of a whole number of periods are supported"
+        if shift == 0:
+            return
+        columns = self.modes(0, [mode])[0] + self._m*np.arange(self._window)
+        delayed = self.occupations[:, columns]
+        kept = max(self._window - shift, 0)
+        self.occupations[:, columns] = 0
+        self.occupations[:, columns[shift:]] = delayed[:, :kept]
+        left = delayed[:, kept:]
+        if left.any():
+            # label of what left the window so far, and the photons leaving it now
+            _, label = np.unique(np.concatenate([self.occupations[:, -1:], left], axis=1), axis=0,
+                                 return_inverse=True)
+            self.occupations[:, -1] = label.reshape(-1)
+
+    def distribution(self, period: int = -1) -> Dict[BasicState, float]:
+        r"""Probability distribution of the states of a period, the other periods being traced out
+
+        :param period: the observed period, by default the last one of the window
+        :return: mapping of the states of the period to their probabilities
+        """
+        if period < 0:
+            period += self._window
+        observed = self.occupations[:, self.modes(period, list(range(self._m)))]
+        states, index = np.unique(observed, axis=0, return_inverse=True)
+        probs = np.bincount(index.reshape(-1), weights=np.abs(self.amplitudes)**2, minlength=len(states))
+        return {BasicState(state): p for state, p in zip(states.tolist(), probs.tolist())}
 
 
 class SVDistribution(defaultdict):
@@ -561,22 +818,20 @@ class SVDistribution(defaultdict):
         :param k: number of samples to draw
         :return: if :math:`k=1` a single sample, if :math:`k>1` a list of :math:`k` samples
         """
-        sample = []
-        for _ in range(k):
-            prob = random.random()
-            if non_null:
-                prob -= sum(v for sv, v in self.items() if sv.n == 0)
-            for sv, v in self.items():
-                if non_null and sv.n == 0:
-                    continue
-                if prob < v:
-                    if k == 1:
-                        return sv
-                    sample.append(sv)
-                    break
-                prob -= v
+        sample = self.sampler(non_null).sample(k)
+        if k == 1:
+            return sample[0]
         return sample
 
+    def sampler(self, non_null: bool = True) -> DistributionSampler:
+        r"""Sampler on the current content of the `SVDistribution`, to draw many times without rescanning it
+
+        :param non_null: excludes null states from the sample generation
+        :return: the sampler, not updated when the distribution changes
+        """
+        items = [(sv, v) for sv, v in self.items() if not non_null or max(sv.n) != 0]
+        return DistributionSampler([sv for sv, _ in items], [v for _, v in items])
+
     def pdisplay(self, output_format="text", n_simplify=True, precision=1e-6, max_v=None, sort=True):
         if sort:
             the_keys = sorted(self.keys(), key=lambda a: -self[a])
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 import perceval as pcvl
+import pytest
 import perceval.lib.symb as symb
 import sympy as sp
 
@@ -64,3 +65,26 @@ def test_analyser_full_issue_2():
             | |0,1,1,0> | 0.004934  | 0.240133  | 0.012162  | 0.237838  | 0.004934  | 0.237838  | 0.012162  | 0.018956  | 0.212088  | 0.018956  |
             +-----------+-----------+-----------+-----------+-----------+-----------+-----------+-----------+-----------+-----------+-----------+
         """).strip()
+
+
+def test_analyser_gram_backend():
+    # the probabilities of the Gram backend are not defined by amplitudes
+    u = pcvl.Matrix.random_unitary(3)
+    gram_backend = pcvl.BackendFactory().get_backend("Gram")(u)
+    gram_backend.gram = pcvl.GramBackend.overlap_gram([0.8, 0.6])
+    input_states = [pcvl.BasicState([1, 1, 0]), pcvl.BasicState([0, 1, 1])]
+    ca = pcvl.CircuitAnalyser(gram_backend, input_states, "*")
+    ca.compute()
+    for iidx, input_state in enumerate(input_states):
+        for oidx, output_state in enumerate(ca.output_states_list):
+            assert pytest.approx(gram_backend.prob(input_state, output_state)) == ca.distribution[iidx, oidx]
+
+
+def test_analyser_distinguishable_backend():
+    u = pcvl.Matrix.random_unitary(3)
+    distinguishable = pcvl.BackendFactory().get_backend("Distinguishable")(u)
+    input_states = [pcvl.BasicState([1, 1, 0]), pcvl.BasicState([0, 2, 0])]
+    ca = pcvl.CircuitAnalyser(distinguishable, input_states, "*")
+    ca.compute()
+    for iidx, input_state in enumerate(input_states):
+        assert pytest.approx(distinguishable.all_prob(input_state)) == ca.distribution[iidx, :]
@@ -0,0 +1,67 @@
+# MIT License
+#
+# Copyright (c) 2022 Quandela
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+import perceval as pcvl
+import perceval.lib.phys as phys
+
+
+def test_postselect_call():
+    ps = pcvl.PostSelect({0: 0, 2: (0, 1)})
+    assert ps(pcvl.BasicState([0, 2, 1]))
+    assert not ps(pcvl.BasicState([1, 1, 0]))
+    assert not ps(pcvl.BasicState([0, 0, 2]))
+    ps_or = ps | pcvl.PostSelect({1: 2})
+    assert ps_or(pcvl.BasicState([0, 0, 1]))
+    assert ps_or(pcvl.BasicState([1, 2, 0]))
+    assert not ps_or(pcvl.BasicState([1, 1, 1]))
+
+
+def test_postselect_mask():
+    ps = pcvl.PostSelect({0: 0, 2: (0, 1)}) | pcvl.PostSelect({1: 2})
+    assert ps.mask(3, 2) == ["0 0", "0 1", " 2 "]
+    assert ps.mask(3, 0) == ["0 0"]
+    assert pcvl.PostSelect({1: 3}).mask(3, 2) is None
+    for backend in ["SLOS", "Naive"]:
+        simulator = pcvl.BackendFactory().get_backend(backend)(pcvl.Matrix.random_unitary(3), n=2, mask=ps)
+        outputs = [output_state for output_state in simulator.allstate_iterator(pcvl.BasicState([1, 1, 0]))]
+        assert len(outputs) == 2
+        assert all(ps(output_state) for output_state in outputs)
+
+
+def test_processor_postselect():
+    c = pcvl.Circuit(4)
+    c.add((0, 1), phys.BS())
+    c.add((1, 2), phys.BS(R=1/3))
+    c.add((2, 3), phys.BS())
+    source = pcvl.Source(brightness=0.8, purity=0.9, indistinguishability=0.9)
+    ps = pcvl.PostSelect({0: 0, 3: 1})
+    p_fn = pcvl.Processor({0: source, 1: source, 2: source}, c, post_select_fn=lambda s: s[0] == 0 and s[3] == 1)
+    p_ps = pcvl.Processor({0: source, 1: source, 2: source}, c, post_select_fn=ps)
+    for backend in ["SLOS", "Naive"]:
+        simulator_backend = pcvl.BackendFactory().get_backend(backend)
+        all_p_fn, sv_fn = p_fn.run(simulator_backend)
+        all_p_ps, sv_ps = p_ps.run(simulator_backend)
+        assert pytest.approx(all_p_fn) == all_p_ps
+        assert len(sv_fn) == len(sv_ps)
+        for sv, p in sv_fn.items():
+            assert pytest.approx(p) == sv_ps[sv]
@@ -20,9 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import numpy as np
 import pytest
 import perceval as pcvl
 import perceval.lib.symb as symb
+from perceval.components.detector import DetectorArray
 
 
 def test_processor_generator_0():
@@ -77,3 +79,44 @@ def test_processor_run():
     assert pytest.approx(all_p) == 1
     assert pytest.approx(sv_out[pcvl.StateVector("|2,0>")]) == 0.5
     assert pytest.approx(sv_out[pcvl.StateVector("|0,2>")]) == 0.5
+
+
+def test_processor_threshold_detectors():
+    source = pcvl.Source()
+    qpu = pcvl.Processor({0: source, 1: source}, symb.BS(),
+                         detectors={0: pcvl.Detector.threshold(), 1: pcvl.Detector.threshold()})
+    for backend in ["SLOS", "Naive"]:
+        all_p, sv_out = qpu.run(pcvl.BackendFactory().get_backend(backend))
+        assert pytest.approx(all_p) == 1
+        assert pytest.approx(sv_out[pcvl.StateVector("|1,0>")]) == 0.5
+        assert pytest.approx(sv_out[pcvl.StateVector("|0,1>")]) == 0.5
+
+
+def test_processor_pseudo_pnr_detector():
+    source = pcvl.Source()
+    qpu = pcvl.Processor({0: source, 1: source}, symb.BS(), detectors={0: pcvl.Detector.pseudo_pnr(2)},
+                         post_select_fn=lambda s: s[1] == 0)
+    all_p, sv_out = qpu.run(pcvl.BackendFactory().get_backend("SLOS"))
+    assert pytest.approx(all_p) == 0.5
+    # two photons on two pixels: both pixels click half of the time
+    assert pytest.approx(sv_out[pcvl.StateVector("|1,0>")]) == 0.5
+    assert pytest.approx(sv_out[pcvl.StateVector("|2,0>")]) == 0.5
+
+
+def test_detector_response():
+    assert pytest.approx(list(pcvl.Detector.pseudo_pnr(3).response(2))) == [0, 1/3, 2/3]
+    assert pytest.approx(list(pcvl.Detector.pseudo_pnr(2).response(3))) == [0, 1/4, 3/4, 0]
+    assert list(pcvl.Detector.threshold().response(3)) == [0, 1, 0, 0]
+    assert list(pcvl.Detector.pnr().response(2)) == [0, 0, 1]
+    # saturation above the number of photons
+    assert pytest.approx(list(pcvl.Detector(max_count=3, n_pixels=4).response(1))) == [0, 1]
+
+
+def test_detector_array_index_cache():
+    detectors = DetectorArray(2, {0: pcvl.Detector.threshold()})
+    for _ in range(20):
+        occupations = np.asarray([[2, 0], [1, 1], [0, 2]])
+        patterns, probs = detectors.detect(occupations, np.asarray([0.25, 0.5, 0.25]))
+        assert patterns.tolist() == [[0, 2], [1, 0], [1, 1]]
+        assert pytest.approx(list(probs)) == [0.25, 0.25, 0.5]
+    assert len(detectors._index_cache) <= 8
@@ -20,12 +20,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import math
 from collections import defaultdict
 import pytest
 import perceval as pcvl
 import perceval.lib.phys as phys
 import sympy as sp
 import numpy as np
+from perceval.utils.permanent import permanent_multiplicities
+import quandelibc as qc
 
 
 def cnot_circuit():
@@ -352,3 +355,316 @@ def test_all_prob():
     c = phys.BS()
     sim = pcvl.BackendFactory().get_backend("Naive")(c)
     assert pytest.approx(np.asarray([0.5, 0, 0.5])) == sim.all_prob(pcvl.BasicState("|1,1>"))
+
+
+def test_prob_batch():
+    u = pcvl.Matrix.random_unitary(4)
+    input_states = [pcvl.BasicState([1, 1, 0, 0]), pcvl.BasicState([0, 2, 0, 1]), pcvl.BasicState([0, 0, 0, 0]),
+                    pcvl.AnnotatedBasicState("|{_:0},{_:1},0,0>")]
+    output_states = [pcvl.BasicState([1, 1, 0, 0]), pcvl.BasicState([0, 0, 2, 1]), pcvl.BasicState([0, 0, 0, 1]),
+                     pcvl.BasicState([0, 0, 0, 0]), pcvl.BasicState([2, 0, 0, 0])]
+    for backend in ["SLOS", "Naive"]:
+        simulator = pcvl.BackendFactory().get_backend(backend)(u)
+        probs = simulator.prob_batch(input_states, output_states)
+        assert probs.shape == (4, 5)
+        for iidx, input_state in enumerate(input_states):
+            for oidx, output_state in enumerate(output_states):
+                assert pytest.approx(float(simulator.prob(input_state, output_state))) == probs[iidx, oidx]
+        amplis = simulator.probampli_batch(input_states[:2], output_states)
+        for iidx, input_state in enumerate(input_states[:2]):
+            for oidx, output_state in enumerate(output_states):
+                assert pytest.approx(simulator.probampli(input_state, output_state)) == amplis[iidx, oidx]
+
+
+def test_all_prob_distinguishable():
+    u = pcvl.Matrix.random_unitary(4)
+    simulator = pcvl.BackendFactory().get_backend("SLOS")(u)
+    assert pytest.approx(1) == sum(simulator.all_prob(pcvl.BasicState([2, 0, 1, 0])))
+    for state in ["|{_:0},{_:1},0,0>", "|2{_:0},{_:1},0,{_:2}>", "|{_:0},0,{_:0},0>"]:
+        input_state = pcvl.AnnotatedBasicState(state)
+        probs = simulator.all_prob(input_state)
+        assert pytest.approx(1) == sum(probs)
+        for output_state, prob in zip(simulator.allstate_iterator(input_state), probs):
+            assert pytest.approx(simulator.prob(input_state, output_state)) == prob
+
+
+def test_slos_rebind():
+    u1 = pcvl.Matrix.random_unitary(4)
+    u2 = pcvl.Matrix.random_unitary(4)
+    input_states = [pcvl.BasicState([1, 1, 0, 0]), pcvl.BasicState([0, 1, 0, 1])]
+    simulator = pcvl.BackendFactory().get_backend("SLOS")(u1)
+    simulator.compile(input_states[0])
+    simulator.compile(input_states[1])
+    fsms = list(simulator.fsms)
+    simulator.rebind(u2)
+    assert fsms == simulator.fsms
+    reference = pcvl.BackendFactory().get_backend("SLOS")(u2)
+    for input_state in input_states:
+        assert not simulator.compile(input_state)
+        assert np.allclose(simulator.all_prob(input_state), reference.all_prob(input_state))
+    for u, sim in zip([u1, u2], simulator.rebind_iterator([u1, u2])):
+        reference = pcvl.BackendFactory().get_backend("SLOS")(u)
+        assert np.allclose(sim.all_prob(input_states[0]), reference.all_prob(input_states[0]))
+
+
+def test_slos_all_prob_stack():
+    unitaries = np.asarray([pcvl.Matrix.random_unitary(6) for _ in range(5)])
+    input_state = pcvl.BasicState([0, 1, 0, 2, 0, 0])
+    for mask in [None, ["0    0"]]:
+        simulator = pcvl.BackendFactory().get_backend("SLOS")(pcvl.Matrix(unitaries[0]), n=3, mask=mask)
+        probs = simulator.all_prob_stack(input_state, unitaries)
+        assert probs.shape[0] == 5
+        for k, u in enumerate(unitaries):
+            reference = pcvl.BackendFactory().get_backend("SLOS")(pcvl.Matrix(u), n=3, mask=mask)
+            assert np.allclose(probs[k], reference.all_prob(input_state))
+
+
+def test_slos_low_memory():
+    u = pcvl.Matrix.random_unitary(6)
+    input_states = [pcvl.BasicState([1, 1, 0, 1, 0, 0]), pcvl.BasicState([0, 2, 0, 0, 1, 0])]
+    simulator = pcvl.BackendFactory().get_backend("SLOS")(u)
+    simulator_low_memory = pcvl.BackendFactory().get_backend("SLOS")(u, low_memory=True)
+    simulator.compile(input_states)
+    simulator_low_memory.compile(input_states)
+    for input_state in input_states:
+        assert np.allclose(simulator.all_prob(input_state), simulator_low_memory.all_prob(input_state))
+    assert simulator_low_memory._compute_paths[0].coefs is None
+    estimate = pcvl.SLOSBackend.estimate_memory(6, 3)
+    assert pcvl.SLOSBackend.estimate_memory(6, 3, low_memory=True) < estimate
+    assert pcvl.SLOSBackend.estimate_memory(6, 3, mask=["0    0"]) < estimate
+
+
+def test_slos_workers():
+    u = pcvl.Matrix.random_unitary(5)
+    input_states = [pcvl.BasicState([1, 1, 0, 0, 0]), pcvl.BasicState([0, 0, 1, 0, 1]),
+                    pcvl.BasicState([0, 2, 0, 0, 0])]
+    simulator = pcvl.BackendFactory().get_backend("SLOS")(u)
+    simulator_workers = pcvl.BackendFactory().get_backend("SLOS")(u, n_workers=2)
+    simulator.compile(input_states)
+    simulator_workers.compile(input_states)
+    for input_state in input_states:
+        assert np.allclose(simulator.all_prob(input_state), simulator_workers.all_prob(input_state))
+    u = pcvl.Matrix.random_unitary(5)
+    simulator.rebind(u)
+    simulator_workers.rebind(u)
+    for input_state in input_states:
+        assert np.allclose(simulator.all_prob(input_state), simulator_workers.all_prob(input_state))
+
+
+def test_slos_workers_postselect():
+    u = pcvl.Matrix.random_unitary(3)
+    input_state = pcvl.BasicState([1, 1, 0])
+    mask = pcvl.PostSelect({0: (0, 1)})
+    simulator = pcvl.BackendFactory().get_backend("SLOS")(u, n=2, mask=mask)
+    simulator_workers = pcvl.BackendFactory().get_backend("SLOS")(u, n=2, mask=mask, n_workers=2)
+    simulator.compile(input_state)
+    simulator_workers.compile(input_state)
+    assert np.allclose(simulator.all_prob(input_state), simulator_workers.all_prob(input_state))
+
+
+def test_slos_indices_of():
+    simulator = pcvl.BackendFactory().get_backend("SLOS")(pcvl.Matrix.random_unitary(6), n=2, mask=["0    0"])
+    input_state = pcvl.BasicState([0, 1, 0, 1, 0, 0])
+    simulator.compile(input_state)
+    output_states = list(simulator.allstate_iterator(input_state))
+    assert list(simulator.indices_of(output_states)) == list(range(len(output_states)))
+    assert list(simulator.indices_of([pcvl.BasicState([1, 0, 0, 0, 0, 1]), pcvl.BasicState([0, 1, 0, 0, 0, 0])])) \
+        == [-1, -1]
+
+
+def test_naive_bunched_states():
+    u = pcvl.Matrix.random_unitary(4)
+    input_state = pcvl.BasicState([8, 8, 0, 0])
+    output_states = [pcvl.BasicState([4, 4, 4, 4]), pcvl.BasicState([16, 0, 0, 0]), pcvl.BasicState([0, 5, 3, 8])]
+    naive = pcvl.BackendFactory().get_backend("Naive")(u, n_threads=2)
+    slos = pcvl.BackendFactory().get_backend("SLOS")(u)
+    for output_state in output_states:
+        assert naive._use_multiplicities(input_state, output_state, 16)
+        assert pytest.approx(slos.prob(input_state, output_state)) == naive.prob(input_state, output_state)
+
+
+def test_permanent_multiplicities():
+    a = pcvl.Matrix.random_unitary(3)
+    row_mult, col_mult = [2, 0, 3], [1, 3, 1]
+    expanded = np.repeat(np.repeat(np.asarray(a), row_mult, axis=0), col_mult, axis=1)
+    assert pytest.approx(qc.permanent_cx(expanded)) == permanent_multiplicities(a, row_mult, col_mult)
+
+
+def test_naive_gather_changed_unitary():
+    naive = pcvl.BackendFactory().get_backend("Naive")(pcvl.Matrix.random_unitary(4))
+    input_state = pcvl.BasicState([1, 1, 1, 0])
+    naive.all_prob(input_state)
+    u = pcvl.Matrix.random_unitary(4)
+    naive.U = u
+    slos = pcvl.BackendFactory().get_backend("SLOS")(u)
+    assert np.allclose(naive.all_prob(input_state), slos.all_prob(input_state))
+
+
+def test_clifford_samples():
+    bs_backend = pcvl.BackendFactory().get_backend("CliffordClifford2017")
+    sim = bs_backend(phys.BS())
+    input_state = pcvl.BasicState([1, 1])
+    samples = sim.samples(input_state, 1000)
+    assert samples.shape == (1000, 2)
+    assert np.all(samples.sum(axis=1) == 2)
+    chunks = list(sim.samples_iterator(input_state, 2500, chunk_size=1000))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    pcvl.random_seed(5)
+    samples = sim.samples(pcvl.BasicState([0, 1]), 5)
+    pcvl.random_seed(5)
+    assert [sim.sample(pcvl.BasicState([0, 1])) for _ in range(5)] == [pcvl.BasicState(s.tolist()) for s in samples]
+
+
+def test_clifford_samples_workers():
+    bs_backend = pcvl.BackendFactory().get_backend("CliffordClifford2017")
+    u = pcvl.Matrix.random_unitary(4)
+    input_state = pcvl.BasicState([1, 1, 0, 0])
+    sim = bs_backend(u)
+    assert np.array_equal(sim.samples(input_state, 200, seed=3), sim.samples(input_state, 200, seed=3))
+    sim_workers = bs_backend(u, n_workers=2)
+    samples = sim_workers.samples(input_state, 200, seed=3)
+    assert samples.shape == (200, 4)
+    assert np.all(samples.sum(axis=1) == 2)
+    assert np.array_equal(samples, bs_backend(u, n_workers=2).samples(input_state, 200, seed=3))
+    chunks = list(sim_workers.samples_iterator(input_state, 300, chunk_size=100, seed=3))
+    assert np.array_equal(np.concatenate(chunks),
+                          np.concatenate(list(sim_workers.samples_iterator(input_state, 300, chunk_size=100, seed=3))))
+
+
+def test_backend_samples():
+    simulator = pcvl.BackendFactory().get_backend("Naive")(phys.BS())
+    samples = simulator.samples(pcvl.BasicState([1, 1]), 1000)
+    assert samples.shape == (1000, 2)
+    # Hong-Ou-Mandel: no coincidence
+    assert not np.any(np.all(samples == 1, axis=1))
+    assert 400 < np.sum(samples[:, 0] == 2) < 600
+    assert simulator.sample(pcvl.BasicState([1, 1])) in [pcvl.BasicState([2, 0]), pcvl.BasicState([0, 2])]
+
+
+def test_mis_sampler():
+    assert "MIS" in pcvl.BackendFactory().list_backend()
+    pcvl.random_seed(2)
+    u = pcvl.Matrix.random_unitary(4)
+    input_state = pcvl.BasicState([1, 1, 0, 0])
+    mis = pcvl.BackendFactory().get_backend("MIS")(u, burn_in=50, thinning=2)
+    samples = mis.samples(input_state, 5000)
+    assert samples.shape == (5000, 4)
+    counts = defaultdict(int)
+    for sample in samples.tolist():
+        counts[tuple(sample)] += 1
+    slos = pcvl.BackendFactory().get_backend("SLOS")(u)
+    tvd = 0.5 * sum(abs(counts[tuple(output_state)]/5000 - p)
+                    for output_state, p in slos.allstateprob_iterator(input_state))
+    assert tvd < 0.1
+    diagnostics = mis.diagnostics(10)
+    assert 0 < diagnostics["acceptance_rate"] <= 1
+    assert len(diagnostics["autocorrelation"]) == 11 and diagnostics["autocorrelation"][0] == pytest.approx(1)
+
+
+def test_distinguishable_backend():
+    u = pcvl.Matrix.random_unitary(5)
+    distinguishable = pcvl.BackendFactory().get_backend("Distinguishable")(u)
+    slos = pcvl.BackendFactory().get_backend("SLOS")(u)
+    annotated_state = pcvl.AnnotatedBasicState("|{_:0},{_:1}{_:2},0,{_:3},0>")
+    input_state = pcvl.BasicState([1, 2, 0, 1, 0])
+    assert np.allclose(distinguishable.all_prob(input_state), slos.all_prob(annotated_state))
+    assert np.allclose([slos.prob(annotated_state, output_state)
+                        for output_state in slos.allstate_iterator(input_state)], distinguishable.all_prob(input_state))
+    # the convolution of the groups of distinguishable photons gives the same distribution
+    assert np.allclose(slos._all_prob_distinguishable([pcvl.BasicState([1, 0, 0, 0, 0]),
+                                                       pcvl.BasicState([0, 1, 0, 0, 0]),
+                                                       pcvl.BasicState([0, 1, 0, 0, 0]),
+                                                       pcvl.BasicState([0, 0, 0, 1, 0])]),
+                       distinguishable.all_prob(input_state))
+    samples = distinguishable.samples(input_state, 1000)
+    assert samples.shape == (1000, 5)
+    assert np.all(samples.sum(axis=1) == 4)
+
+
+def test_gram_backend():
+    u = pcvl.Matrix.random_unitary(4)
+    input_state = pcvl.BasicState([1, 1, 1, 0])
+    gram_backend = pcvl.BackendFactory().get_backend("Gram")(u)
+    slos = pcvl.BackendFactory().get_backend("SLOS")(u)
+    output_states = list(slos.allstate_iterator(input_state))
+    assert np.allclose([gram_backend.prob(input_state, o) for o in output_states], slos.all_prob(input_state))
+    gram_backend.gram = np.eye(3)
+    distinguishable = pcvl.BackendFactory().get_backend("Distinguishable")(u)
+    assert np.allclose([gram_backend.prob(input_state, o) for o in output_states],
+                       distinguishable.all_prob(input_state))
+    # same model as a mixture of annotated states produced by sources sharing their discernability tags
+    indistinguishability = [0.8, 0.6, 0.9]
+    context = {"discernability_tag": 1}
+    sources = {k: pcvl.Source(indistinguishability=indistinguishability[k], indistinguishability_model="linear",
+                              context=context) for k in range(3)}
+    _, expected = pcvl.Processor(sources, pcvl.Circuit(U=u)).run(slos.__class__)
+    gram_backend.gram = pcvl.GramBackend.overlap_gram(indistinguishability)
+    for output_state in output_states:
+        assert pytest.approx(expected[pcvl.StateVector(output_state)]) == gram_backend.prob(input_state, output_state)
+    # order 0 is the distinguishable distribution
+    gram_backend.max_order = 0
+    assert np.allclose([gram_backend.prob(input_state, o) for o in output_states],
+                       distinguishable.all_prob(input_state))
+
+
+def test_gram_backend_bunched_input():
+    u = pcvl.Matrix.random_unitary(3)
+    input_state = pcvl.BasicState([2, 1, 0])
+    gram_backend = pcvl.BackendFactory().get_backend("Gram")(u)
+    slos = pcvl.BackendFactory().get_backend("SLOS")(u)
+    output_states = list(slos.allstate_iterator(input_state))
+    assert np.allclose([gram_backend.prob(input_state, o) for o in output_states], slos.all_prob(input_state))
+
+
+def test_lossy_slos():
+    transmission = 0.7
+    t = pcvl.Matrix(np.sqrt(transmission) * np.asarray(pcvl.Matrix.random_unitary(3)))
+    slos = pcvl.BackendFactory().get_backend("SLOS")(t)
+    assert slos.lossy
+    input_state = pcvl.BasicState([1, 1, 1])
+    detected = defaultdict(float)
+    for output_state, p in slos.allstateprob_iterator(input_state):
+        detected[output_state.n] += p
+    # uniform losses: binomial number of detected photons
+    for n in range(4):
+        assert pytest.approx(math.comb(3, n) * transmission**n * (1-transmission)**(3-n)) == detected[n]
+    output_state = pcvl.BasicState([0, 1, 0])
+    assert pytest.approx(slos.prob(input_state, output_state)) == \
+        dict(slos.allstateprob_iterator(input_state))[output_state]
+    output_states = [output_state, pcvl.BasicState([1, 1, 1]), pcvl.BasicState([0, 0, 0])]
+    assert np.allclose(slos.prob_batch([input_state], output_states),
+                       [[slos.prob(input_state, o) for o in output_states]])
+    with pytest.raises(AssertionError):
+        slos.prob(pcvl.AnnotatedBasicState("|{_:0},{_:1},0>"), output_state)
+    assert not pcvl.BackendFactory().get_backend("SLOS")(pcvl.Matrix.random_unitary(3)).lossy
+
+
+def test_lossy_components():
+    c = pcvl.Circuit(2) // phys.BS(loss=0.2) // (1, phys.PS(0.3, loss=0.5))
+    slos = pcvl.BackendFactory().get_backend("SLOS")(c)
+    assert slos.lossy
+    probs = dict(slos.allstateprob_iterator(pcvl.BasicState([1, 0])))
+    assert pytest.approx(0.4) == probs[pcvl.BasicState([1, 0])]
+    assert pytest.approx(0.2) == probs[pcvl.BasicState([0, 1])]
+    assert pytest.approx(0.4) == probs[pcvl.BasicState([0, 0])]
+    assert "loss=0.5" in phys.PS(0.3, loss=0.5).describe()
+
+
+def test_lossy_samplers():
+    t = pcvl.Matrix(np.asarray(pcvl.Matrix.random_unitary(3)) @ np.diag(np.sqrt([0.9, 0.5, 1])))
+    distinguishable = pcvl.BackendFactory().get_backend("Distinguishable")(t)
+    input_state = pcvl.BasicState([1, 1, 1])
+    detected = defaultdict(float)
+    for output_state, p in distinguishable.allstateprob_iterator(input_state):
+        detected[output_state.n] += p
+    assert pytest.approx([0, 0.05, 0.5, 0.45]) == [detected[n] for n in range(4)]
+    # the backend of the loss channel is lossless by construction
+    assert not distinguishable._loss_backend().lossy
+    assert not pcvl.BackendFactory().get_backend("Distinguishable")(t, lossless=True).lossy
+    samples = distinguishable.samples(input_state, 10000)
+    assert samples.shape == (10000, 3)
+    assert 0.45 < np.mean(samples.sum(axis=1) == 2) < 0.55
+    clifford = pcvl.BackendFactory().get_backend("CliffordClifford2017")(t)
+    samples = clifford.samples(pcvl.BasicState([0, 1, 0]), 10000)
+    assert samples.shape == (10000, 3)
+    assert 0.45 < np.mean(samples.sum(axis=1)) < 0.55
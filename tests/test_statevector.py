@@ -25,6 +25,9 @@ import perceval as pcvl
 import perceval.lib.symb as symb
 
 import sympy as sp
+import numpy as np
+from copy import copy
+import itertools
 
 from test_circuit import strip_line_12
 
@@ -114,6 +117,15 @@ def test_state_superposition_sub():
             '(Abs(ε)**2 + 1)**(-0.5)*|0,1>-ε/(Abs(ε)**2 + 1)**0.5*|1,0>')
 
 
+
+def test_state_superposition_symbolic_exact():
+    # numeric amplitudes joining a symbolic state vector stay exact, whatever the order of the operands
+    expected = 'ε/(Abs(ε)**2 + 1)**0.5*|1,0>+(Abs(ε)**2 + 1)**(-0.5)*|0,1>'
+    assert str(sp.S("ε")*pcvl.StateVector("|1,0>")+pcvl.StateVector("|0,1>")) == expected
+    sv = sp.S("ε")*pcvl.StateVector("|1,0>")
+    sv[pcvl.BasicState("|0,1>")] = 1.0
+    assert str(sv) == expected
+
 def test_state_superposition_bs():
     assert (str(pcvl.BasicState("|0,1>")-pcvl.BasicState("|1,0>")) ==
             'sqrt(2)/2*|0,1>-sqrt(2)/2*|1,0>')
@@ -214,3 +226,145 @@ def test_sv_sample():
     assert len(sample) == 2
     assert isinstance(sample[0], pcvl.StateVector)
     assert isinstance(sample[1], pcvl.StateVector)
+
+
+def test_svd_sample_non_null():
+    svd = pcvl.SVDistribution(pcvl.StateVector("|0,0>"))
+    svd[pcvl.StateVector("|1,0>")] = 0.25
+    svd[pcvl.StateVector("|0,1>")] = 0.75
+    assert all(sv.n == [1] for sv in svd.sample(100))
+    assert any(sv.n == [0] for sv in svd.sample(100, non_null=False))
+
+
+def test_distribution_sampler():
+    sampler = pcvl.DistributionSampler(["a", "b", "c", "d"], [0.5, 0, 1.5, 0])
+    assert sampler.total == 2
+    indexes = sampler.sample_indexes(1000)
+    assert set(indexes) == {0, 2}
+    assert 150 < np.sum(indexes == 0) < 350
+    assert set(sampler.sample(10)) <= {"a", "c"}
+
+
+def test_sv_time_sequence():
+    sequence = pcvl.SVTimeSequence(pcvl.StateVector([1, 0]), 3)
+    assert sequence.occupations.shape == (1, 7)
+    assert pytest.approx(sequence.distribution()) == {pcvl.BasicState([1, 0]): 1}
+    sequence.apply_delta_t(0, 1)
+    assert list(sequence.occupations[0, :6]) == [0, 0, 1, 0, 1, 0]
+    assert pytest.approx(sequence.distribution(0)) == {pcvl.BasicState([0, 0]): 1}
+    # a superposition leaving the window: the photons out of the window are traced out
+    sequence = pcvl.SVTimeSequence(pcvl.StateVector([1, 0]) + pcvl.StateVector([0, 1]), 1)
+    sequence.apply_delta_t(1, 1)
+    assert pytest.approx(sequence.distribution()) == {pcvl.BasicState([1, 0]): 0.5, pcvl.BasicState([0, 0]): 0.5}
+
+
+def test_state_vector_arrays():
+    st1 = pcvl.StateVector("|0,1>") + pcvl.StateVector("|1,0>")
+    st2 = st1 + 1j*pcvl.StateVector("|1,0>") + pcvl.StateVector("|2,0>")
+    # insertion order is kept, shared states are summed
+    assert st2.keys() == [pcvl.BasicState("|0,1>"), pcvl.BasicState("|1,0>"), pcvl.BasicState("|2,0>")]
+    assert list(st2.amplitudes) == [1, 1+1j, 1]
+    assert st2[pcvl.BasicState("|1,1>")] == 0 and pcvl.BasicState("|1,1>") not in st2
+    assert st2 == copy(st2) and st2 != st1
+    del st2[pcvl.BasicState("|1,0>")]
+    assert dict(st2.items()) == {pcvl.BasicState("|0,1>"): 1, pcvl.BasicState("|2,0>"): 1}
+    assert pytest.approx(sum(abs(v)**2 for v in (3*st2).values())) == 18
+    assert str(3*st2) == "sqrt(2)/2*|0,1>+sqrt(2)/2*|2,0>"
+
+
+
+class _CollidingState(pcvl.BasicState):
+    def __hash__(self):
+        return 0
+
+
+def test_state_vector_hash_collision():
+    # the basis states are matched on their hashes, and checked
+    st1 = pcvl.StateVector(None)
+    st1[_CollidingState("|0,1>")] = 1
+    st1[_CollidingState("|1,0>")] = 1
+    st2 = pcvl.StateVector(None)
+    st2[_CollidingState("|1,0>")] = 1
+    st2 = st1 + st2
+    assert st2.keys() == [pcvl.BasicState("|0,1>"), pcvl.BasicState("|1,0>")]
+    assert list(st2.amplitudes) == [1, 2]
+
+def test_annotated_state_hash():
+    st1 = pcvl.AnnotatedBasicState("|{_:0}{_:1},{P:H}>")
+    assert hash(st1) == hash(pcvl.AnnotatedBasicState("|{_:1}{_:0},{P:H}>"))
+    assert hash(st1) != hash(pcvl.AnnotatedBasicState("|{_:0}{_:2},{P:H}>"))
+    assert hash(pcvl.AnnotatedBasicState([1, 1], {})) == hash(pcvl.BasicState([1, 1]))
+    # the cached hash follows the annotation changes
+    st1.set_photon_annotations(2, {"_": 2})
+    assert hash(st1) == hash(pcvl.AnnotatedBasicState("|{_:0}{_:2},{P:H}>"))
+    assert len({pcvl.StateVector("|{_:0},1>"): 1, pcvl.StateVector("|{_:0},1>"): 2,
+                pcvl.StateVector("|{_:1},1>"): 3}) == 2
+
+
+
+def test_annotated_state_annotations_copies():
+    st1 = pcvl.AnnotatedBasicState("|{_:0},{_:1}>")
+    states = {st1}
+    # the returned annotations are copies, editing them leaves the state and its cached hash untouched
+    st1.get_photon_annotations(1)["_"] = 2
+    st1.get_mode_annotations(1)[0]["_"] = 2
+    assert str(st1) == "|{_:0},{_:1}>"
+    assert pcvl.AnnotatedBasicState("|{_:0},{_:1}>") in states
+    # the product has its own annotations
+    st2 = st1 * pcvl.AnnotatedBasicState("|{_:2}>")
+    st2.set_photon_annotations(1, {"_": 3})
+    assert str(st1) == "|{_:0},{_:1}>" and str(st2) == "|{_:3},{_:1},{_:2}>"
+
+
+def test_state_vector_lazy_normalization():
+    sv = pcvl.StateVector("|1,0>")
+    sv[pcvl.BasicState("|0,1>")] = 1
+    # raw iteration: the pending normalization is not applied, and the state vector can be updated
+    for state in sv.iterate(normalize=False):
+        sv[state] += 1
+    assert list(sv.amplitudes) == [2, 2]
+    sv[pcvl.BasicState("|1,1>")] = 1e-9
+    sv.normalize()
+    assert len(sv) == 2 and pytest.approx(list(sv.amplitudes)) == [2**-0.5, 2**-0.5]
+    assert list(sv) == [pcvl.BasicState("|1,0>"), pcvl.BasicState("|0,1>")]
+
+
+def _brute_force_partition(state, distribution):
+    photon_modes = [k for k in range(state.m) for _ in range(state[k])]
+    partitions = set()
+    for order in itertools.permutations(range(state.n)):
+        parts = []
+        start = 0
+        for count in distribution:
+            occupations = [0] * state.m
+            for photon in order[start:start+count]:
+                occupations[photon_modes[photon]] += 1
+            parts.append(tuple(occupations))
+            start += count
+        partitions.add(tuple(parts))
+    return partitions
+
+
+def test_partition():
+    for state, distribution in [("|2,1,0,1>", [2, 2]), ("|2,1,0,1>", [1, 2, 1]), ("|3,0,1>", [1, 3]),
+                                ("|1,1,1>", [1, 1, 1]), ("|2,1>", [1])]:
+        state = pcvl.AnnotatedBasicState(state)
+        partitions = state.partition(distribution)
+        assert len(partitions) == len(set(partitions))
+        assert {tuple(tuple(part) for part in partition) for partition in partitions} == \
+            _brute_force_partition(state, distribution)
+    # the partitions only depend on the occupations and the distribution
+    st1 = pcvl.AnnotatedBasicState("|2{_:0},{_:1},0,1>")
+    assert st1.partition([2, 2]) == pcvl.AnnotatedBasicState("|2,1,0,1>").partition([2, 2])
+    assert st1.separate_state() == st1.separate_state()
+
+
+def test_separate_state_copies():
+    st1 = pcvl.AnnotatedBasicState("|{_:0},{_:1},0>")
+    separated = st1.separate_state()
+    separated[0] += 1
+    assert st1.separate_state() == [pcvl.BasicState("|1,0,0>"), pcvl.BasicState("|0,1,0>")]
+    # a single group is the state itself, its changes reset the separation
+    st2 = pcvl.AnnotatedBasicState("|{_:0},{_:0},0>")
+    st2.separate_state()[0].set_photon_annotations(2, {"_": 1})
+    assert st2.separate_state() == [pcvl.BasicState("|1,0,0>"), pcvl.BasicState("|0,1,0>")]
@@ -65,3 +65,60 @@ def test_basic_interference():
     c = phys.BS()
     sim = simulator_backend(c, use_symbolic=False)
     assert pytest.approx(sim.prob(pcvl.BasicState([1, 1]), pcvl.BasicState([2, 0]))) == 0.5
+
+
+def test_stepper_transition_cache():
+    circuit = pcvl.Circuit(3)
+    circuit.add((0, 1), phys.BS())
+    circuit.add((1,), phys.PS(pcvl.P("phi")))
+    circuit.add((1, 2), phys.BS())
+    sim = pcvl.BackendFactory().get_backend("Stepper")(circuit, cache_size=6)
+    naive = pcvl.BackendFactory().get_backend("Naive")
+    input_state = pcvl.BasicState([0, 1, 1])
+    for phi in [0.3, 1.2, 0.3]:
+        circuit.get_parameters()[0].set_value(phi)
+        expected = naive(circuit.compute_unitary(use_symbolic=False))
+        for output_state in sim.allstate_iterator(input_state):
+            assert pytest.approx(expected.prob(input_state, output_state)) == sim.prob(input_state, output_state)
+        # the cache is bounded, the oldest tables are evicted
+        assert len(sim._tables) <= 6
+    # same parameters and input: the tables are reused
+    sim = pcvl.BackendFactory().get_backend("Stepper")(circuit)
+    sim.compile(input_state)
+    tables = dict(sim._tables)
+    circuit.get_parameters()[0].set_value(1.2)
+    sim.compile(input_state)
+    circuit.get_parameters()[0].set_value(0.3)
+    sim.compile(input_state)
+    assert all(sim._tables[key] is table for key, table in tables.items())
+
+
+def test_stepper_numeric_path():
+    circuit = pcvl.Circuit(4)
+    for k in range(6):
+        circuit.add((k % 3, k % 3 + 1), phys.BS(theta=0.3*k+0.1))
+        circuit.add((k % 4,), phys.PS(0.7*k))
+    sim = pcvl.BackendFactory().get_backend("Stepper")(circuit)
+    naive = pcvl.BackendFactory().get_backend("Naive")(circuit.compute_unitary(use_symbolic=False))
+    input_state = pcvl.BasicState([1, 0, 2, 1])
+    for output_state in naive.allstate_iterator(input_state):
+        assert pytest.approx(naive.prob(input_state, output_state)) == sim.prob(input_state, output_state)
+
+
+def test_stepper_time_delay_hom():
+    # photons of consecutive periods meet on the second beam splitter
+    circuit = pcvl.Circuit(2)
+    circuit.add((0, 1), phys.BS())
+    circuit.add((1,), phys.DT(1))
+    circuit.add((0, 1), phys.BS())
+    sim = pcvl.BackendFactory().get_backend("Stepper")(circuit)
+    input_state = pcvl.BasicState([1, 0])
+    expected = {pcvl.BasicState("|0,0>"): 0.25, pcvl.BasicState("|1,0>"): 0.25, pcvl.BasicState("|0,1>"): 0.25,
+                pcvl.BasicState("|2,0>"): 0.125, pcvl.BasicState("|0,2>"): 0.125, pcvl.BasicState("|1,1>"): 0}
+    for output_state, p in expected.items():
+        assert pytest.approx(p, abs=1e-12) == sim.prob(input_state, output_state)
+    assert pytest.approx(1) == sum(p for _, p in sim.allstateprob_iterator(input_state))
+    # the outputs have no amplitudes, the analyser goes through prob
+    ca = pcvl.CircuitAnalyser(sim, [input_state], list(expected))
+    ca.compute()
+    assert pytest.approx(list(expected.values()), abs=1e-12) == list(ca.distribution[0])